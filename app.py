@@ -3,46 +3,29 @@
 # sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
 import streamlit as st
-import chromadb
-from chromadb.utils import embedding_functions
-from google import genai
-import os
 from dotenv import load_dotenv
 
+import query_service
+import vector_store
+
 # --- SETUP ---
 load_dotenv()
 st.set_page_config(page_title="FinSight AI", layout="wide")
 
-# Initialize Clients (Cached to prevent reloading on every click)
-@st.cache_resource
-def get_chroma_collection():
-    DB_PATH = "./chroma_db"
-    EMBEDDING_MODEL = "all-MiniLM-L6-v2"
-    client = chromadb.PersistentClient(path=DB_PATH)
-    ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL)
-    return client.get_collection(name="financial_knowledge", embedding_function=ef)
+N_RESULTS = 5
+MODEL_OPTIONS = ["gemini-3-flash-preview", "gemma-3-12b-it"]
+SAME_MODEL = "Same as AI Model"
 
+# Initialize once per server (Cached to prevent reloading on every click).
+# Retrieval and generation run in the shared query service, so identical
+# questions from different sessions are answered by one Gemini call.
 @st.cache_resource
-def get_gemini_client():
-    api_key = os.environ.get("GEMINI_API_KEY")
-    return genai.Client(api_key=api_key)
-
-collection = get_chroma_collection()
-client = get_gemini_client()
-
-# --- LOGIC ---
-def retrieve_filtered(query, source_type, n=5):
-    results = collection.query(
-        query_texts=[query],
-        n_results=n,
-        where={"source_type": source_type}
-    )
-    documents = results['documents'][0] if results['documents'] else []
-    metadatas = results['metadatas'][0] if results['metadatas'] else []
-    return documents, metadatas
+def load_query_service():
+    # Loads the client, embedding model and collection(s) up front
+    vector_store.warm_up(background=False, create=False)
+    return query_service.get_service()
 
-def format_context_for_llm(documents):
-    return "\n".join([f"- {doc}" for doc in documents])
+load_query_service()
 
 # --- UI LAYOUT ---
 st.title("🤖 FinSight: Dual-Source Financial Analysis")
@@ -51,19 +34,37 @@ st.markdown("Compare **Institutional Reports** vs. **Retail Sentiment** instantl
 # Sidebar for controls
 with st.sidebar:
     st.header("Configuration")
-    model_choice = st.selectbox("AI Model", ["gemini-3-flash-preview", "gemma-3-12b-it"])
+    model_choice = st.selectbox("AI Model", MODEL_OPTIONS)
+    parallel_mode = st.checkbox(
+        "Parallel perspectives", value=False,
+        help="Summarize both sources concurrently and show each section as soon as it is ready.",
+    )
+    section_models = {}
+    if parallel_mode:
+        # Per-section models, e.g. a bigger model for the dense broker reports
+        for section in query_service.SECTIONS:
+            choice = st.selectbox(
+                f"{section.capitalize()} model", [SAME_MODEL] + MODEL_OPTIONS, key=f"model_{section}"
+            )
+            if choice != SAME_MODEL:
+                section_models[section] = choice
 
 # Main Input
 query = st.text_input("Enter a financial question or topic (e.g., 'Inflation outlook'):")
 
 if st.button("Analyze") and query:
     with st.spinner("🔍 Retrieving data from Vector DB..."):
-        # 1. Retrieve Data
-        inst_docs, inst_meta = retrieve_filtered(query, "institutional")
-        retail_docs, retail_meta = retrieve_filtered(query, "retail")
-        
-        inst_ctx = format_context_for_llm(inst_docs)
-        retail_ctx = format_context_for_llm(retail_docs)
+        # 1. Retrieve Data (both sources in parallel, coalesced across sessions)
+        try:
+            retrieved = query_service.retrieve_sync(query, n=N_RESULTS)
+        except TimeoutError:
+            st.error("❌ Retrieval timed out. Please try again.")
+            st.stop()
+
+        inst_docs = retrieved["institutional"]["documents"]
+        inst_meta = retrieved["institutional"]["metadatas"]
+        retail_docs = retrieved["retail"]["documents"]
+        retail_meta = retrieved["retail"]["metadatas"]
 
     # 2. Display Raw Sources (Expandable)
     with st.expander("📂 View Retrieved Source Documents"):
@@ -84,36 +85,33 @@ if st.button("Analyze") and query:
     # 3. Generate Answer
     if not inst_docs and not retail_docs:
         st.error("❌ No relevant data found in the database.")
+    elif parallel_mode:
+        st.markdown("---")
+        # One placeholder per section, filled in whichever order they finish
+        placeholders = {}
+        for section in query_service.SECTIONS:
+            placeholders[section] = st.empty()
+            placeholders[section].markdown(f"{query_service.SECTION_TITLES[section]}\n\n⏳ _Generating..._")
+        try:
+            for section, text in query_service.analyze_sections_iter(
+                query, model=model_choice, n=N_RESULTS, retrieved=retrieved, models=section_models
+            ):
+                if section == "done":
+                    if text["error"]:
+                        st.error(text["error"])
+                    continue
+                placeholders[section].markdown(f"{query_service.SECTION_TITLES[section]}\n{text}")
+        except TimeoutError:
+            st.error("Timed out waiting for the analysis.")
     else:
         with st.spinner("🤖 Generating Analysis..."):
-            prompt = f"""
-            You are a Financial Analyst.
-            
-            USER QUERY: {query}
-            
-            ### INSTITUTIONAL DATA:
-            {inst_ctx}
-            
-            ### RETAIL DATA:
-            {retail_ctx}
-            
-            OUTPUT FORMAT:
-            ## 🏛️ Institutional Perspective
-            [Summary]
-            
-            ## 🗣️ Retail/Market Sentiment
-            [Summary]
-            
-            ## ⚖️ Divergence Analysis
-            [Comparison]
-            """
-            
             try:
-                response = client.models.generate_content(
-                    model=model_choice,
-                    contents=prompt
-                )
+                result = query_service.analyze_sync(query, model=model_choice, n=N_RESULTS, retrieved=retrieved)
+            except TimeoutError:
+                result = {"answer": None, "error": "Timed out waiting for the analysis."}
+
+            if result["error"]:
+                st.error(result["error"])
+            else:
                 st.markdown("---")
-                st.markdown(response.text)
-            except Exception as e:
-                st.error(f"Error communicating with Gemini: {e}")
\ No newline at end of file
+                st.markdown(result["answer"])
@@ -2,12 +2,26 @@ import os
 import json
 import time
 import random
-from google import genai
 from dotenv import load_dotenv
 
+import profiling
+from env_flags import env_flag
+from failure_ledger import PERMANENT, TRANSIENT, get_ledger, model_not_found
+from work_claims import file_version, get_claims
+
 # --- SETUP ---
 load_dotenv()
-client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+
+# The Gemini SDK is only imported (and the client created) on the first LLM
+# call, so the watcher can import this module without paying for it.
+_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        from google import genai
+        _client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+    return _client
 
 RETAIL_INPUT_DIR = "data/retail/scraped"
 INSTITUTIONAL_INPUT_DIR = "data/institutional/scraped"
@@ -23,6 +37,21 @@ MODEL_ROSTER = [
     "gemini-2.5-flash-lite",   # Fast (might be busy/503)
 ]
 
+# Compact retail transcripts locally before sending them to the LLM
+# (see transcript_compactor.py). Override with COMPACT_TRANSCRIPTS=0.
+COMPACT_TRANSCRIPTS = True
+
+def compaction_enabled():
+    return env_flag("COMPACT_TRANSCRIPTS", COMPACT_TRANSCRIPTS)
+
+def available_models():
+    """
+    The roster minus models the ledger has marked NOT_FOUND.
+    """
+    ledger = get_ledger()
+    models = [m for m in MODEL_ROSTER if not ledger.should_skip(f"model:{m}")]
+    return models or MODEL_ROSTER
+
 def clean_json_string(text):
     if not text: return ""
     clean = text.strip()
@@ -31,8 +60,25 @@ def clean_json_string(text):
     if clean.endswith("```"): clean = clean[:-3]
     return clean
 
+def parse_header(raw_text):
+    """
+    fetch_data writes 'Title: ...', 'Source: ...' and (when YouTube gives us
+    one) 'Published: YYYYMMDD' at the top of each transcript. Keep the title
+    and date so ingest can tag units with tickers and a publication date.
+    """
+    header = {}
+    for line in raw_text.splitlines()[:5]:
+        key, _, value = line.partition(":")
+        if key in ("Title", "Published") and value.strip():
+            header[key.lower()] = value.strip()
+    return header
+
 # --- YOUR CORE LOGIC (Retained) ---
 def process_file(filepath, category, model_name, output_dir):
+    """
+    Returns True if the file was sent to the LLM (so callers know whether to
+    pace themselves), False if it was skipped.
+    """
     filename = os.path.basename(filepath)
     # Handle extensions safely (.txt/.pdf -> .json)
     base_name = os.path.splitext(filename)[0]
@@ -41,42 +87,89 @@ def process_file(filepath, category, model_name, output_dir):
 
     if os.path.exists(output_filename):
         print(f"⏭️ Skipping: {new_filename}")
-        return
+        return False
+
+    # Failure ledger: skip files that keep failing until their backoff is over
+    ledger = get_ledger()
+    ledger_key = f"file:{category.lower()}/{filename}"
+    if ledger.should_skip(ledger_key):
+        print(f"🚫 Skipping: {filename} (recent failure, see failure_ledger.py list)")
+        return False
+
+    # Several workers may share data/: claim the file so only one pays for the LLM call
+    claim_key = f"process:{category.lower()}/{filename}"
+    with get_claims().lease(claim_key, path=os.path.abspath(filepath), version=file_version(filepath)) as lease:
+        if not lease:
+            print(f"🔒 Skipping: {filename} (claimed by another worker)")
+            return False
+        # Another worker may have finished it between our check and the claim
+        if os.path.exists(output_filename):
+            print(f"⏭️ Skipping: {new_filename}")
+            return False
+
+        called_llm = extract_units(filepath, category, model_name, output_filename, ledger, ledger_key)
+        lease.outcome = "done" if os.path.exists(output_filename) else "failed"
+        return called_llm
+
+def extract_units(filepath, category, model_name, output_filename, ledger, ledger_key):
+    """
+    The LLM extraction for one claimed file. Same return value as process_file.
+    """
+    filename = os.path.basename(filepath)
+    new_filename = os.path.basename(output_filename)
+    output_dir = os.path.dirname(output_filename)
 
     try:
         with open(filepath, "r", encoding="utf-8") as f:
             raw_text = f.read()
-        if not raw_text.strip(): return
+        if not raw_text.strip(): return False
     except Exception as e:
         print(f"❌ Read Error: {e}")
-        return
+        ledger.record_failure(ledger_key, e, stage="batch_processor")
+        return False
+
+    # Merge caption fragments, strip filler/repetition -> fewer input tokens
+    compaction = None
+    if category == "RETAIL" and compaction_enabled():
+        from transcript_compactor import compact_transcript
+        raw_text, compaction = compact_transcript(raw_text)
+        print(f"🗜️ Compacted transcript to {compaction['compression_ratio']:.0%} of original size")
 
     print(f"🔹 Processing [{category}] with 🤖 {model_name}...")
 
     prompt = f"""
     You are a Financial Analyst. Extract logical units from this {category} text.
     Output JSON list only.
-    Schema: {{ "text": "quote", "type": "FACT/PRINCIPLE/OPINION", "reasoning": "string" }}
+    Schema: {{ "text": "quote", "type": "FACT/PRINCIPLE/OPINION", "reasoning": "string", "entities": ["Bursa company names or stock codes mentioned, [] if none"] }}
     TEXT: {raw_text[:30000]}
     """
 
     # Retry Logic
     max_retries = 3
+    last_error = "retries exhausted"
     for attempt in range(max_retries):
         try:
-            response = client.models.generate_content(
-                model=model_name,
-                contents=prompt
-            )
+            with profiling.section("llm.generate"):
+                response = get_client().models.generate_content(
+                    model=model_name,
+                    contents=prompt
+                )
             
             if not response.text:
                 print(f"⚠️ Empty response from {model_name}")
-                return
+                ledger.record_failure(ledger_key, f"Empty response from {model_name}",
+                                      stage="batch_processor", kind=TRANSIENT)
+                return True
 
-            data = json.loads(clean_json_string(response.text))
+            with profiling.section("json.parse"):
+                data = json.loads(clean_json_string(response.text))
             
+            meta = {"source": filename, "model": model_name, "time": time.time()}
+            meta.update(parse_header(raw_text))
+            if compaction:
+                meta["compaction"] = compaction
             final_output = {
-                "meta": {"source": filename, "model": model_name, "time": time.time()},
+                "meta": meta,
                 "data": data
             }
             
@@ -88,24 +181,36 @@ def process_file(filepath, category, model_name, output_dir):
                 json.dump(final_output, f, indent=4)
             
             print(f"✅ Saved: {new_filename}")
-            return 
+            ledger.record_success(ledger_key)
+            return True
 
         except Exception as e:
             err_msg = str(e)
-            if "404" in err_msg or "NOT_FOUND" in err_msg:
+            last_error = e
+            if model_not_found(e):
+                # The model is gone, not the file: stop offering this model
                 print(f"❌ Model {model_name} NOT FOUND.")
-                return 
-            if "503" in err_msg or "UNAVAILABLE" in err_msg:
-                wait_time = (attempt + 1) * 5 
-                print(f"⏳ Server Busy ({model_name}). Sleeping {wait_time}s...")
-                time.sleep(wait_time)
-                continue
-            if "429" in err_msg:
-                print(f"⏳ Rate Limit. Sleeping 30s...")
-                time.sleep(30)
-                continue
+                ledger.record_failure(f"model:{model_name}", e, stage="batch_processor", kind=PERMANENT)
+                return True
+            # Bad model output: numbers in a JSONDecodeError are positions, not statuses
+            if not isinstance(e, json.JSONDecodeError):
+                if "503" in err_msg or "UNAVAILABLE" in err_msg:
+                    wait_time = (attempt + 1) * 5
+                    print(f"⏳ Server Busy ({model_name}). Sleeping {wait_time}s...")
+                    time.sleep(wait_time)
+                    continue
+                if "429" in err_msg:
+                    print(f"⏳ Rate Limit. Sleeping 30s...")
+                    time.sleep(30)
+                    continue
+            # e.g. JSONDecodeError: transient, another model/attempt may do better
             print(f"❌ Error on {filename}: {err_msg}")
-            return
+            kind = ledger.record_failure(ledger_key, e, stage="batch_processor")
+            print(f"   📒 Logged as {kind} failure.")
+            return True
+
+    ledger.record_failure(ledger_key, last_error, stage="batch_processor", kind=TRANSIENT)
+    return True
 
 # --- NEW: The Bridge for the Watcher ---
 def process_single_file(input_path, output_dir):
@@ -116,8 +221,8 @@ def process_single_file(input_path, output_dir):
     # 1. Guess Category from path
     category = "RETAIL" if "retail" in input_path.lower() else "INSTITUTIONAL"
     
-    # 2. Pick a Model (Randomly to utilize your roster)
-    selected_model = random.choice(MODEL_ROSTER)
+    # 2. Pick a Model (Randomly to utilize your roster, minus NOT_FOUND ones)
+    selected_model = random.choice(available_models())
     
     # 3. Call your original logic
     process_file(input_path, category, selected_model, output_dir)
@@ -136,15 +241,20 @@ def run_batch(input_dir, output_dir, category):
     for i, filename in enumerate(files):
         filepath = os.path.join(input_dir, filename)
         
-        # Rotate Models
-        current_model = MODEL_ROSTER[model_index % len(MODEL_ROSTER)]
+        # Rotate Models (skipping any the ledger knows are NOT_FOUND)
+        models = available_models()
+        current_model = models[model_index % len(models)]
         
-        process_file(filepath, category, current_model, output_dir)
+        called_llm = process_file(filepath, category, current_model, output_dir)
         
         model_index += 1
-        if i < len(files) - 1: 
+        # Only pace real LLM calls; skipped/known-bad files cost no time
+        if called_llm and i < len(files) - 1: 
             time.sleep(10) # Your preferred sleep time
 
 if __name__ == "__main__":
+    profiling.start("batch_processor")  # PROFILE=1 or --profile
+    # Safe to run on several hosts at once: files are claimed (see work_claims.py)
+    print(f"👷 Worker: {get_claims().worker}")
     run_batch(RETAIL_INPUT_DIR, RETAIL_OUTPUT_DIR, "RETAIL")
     run_batch(INSTITUTIONAL_INPUT_DIR, INSTITUTIONAL_OUTPUT_DIR, "INSTITUTIONAL")
\ No newline at end of file
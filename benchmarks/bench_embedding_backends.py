@@ -0,0 +1,110 @@
+"""
+PyTorch (sentence-transformers) vs. int8 ONNX embedding benchmark.
+
+Embeds the extracted units under data/*/processed with both backends and reports:
+  - throughput (units/s) for each backend
+  - mean cosine similarity between the two vectors of the same unit
+  - top-k retrieval agreement: for each query, |topk_torch ∩ topk_onnx| / k
+
+Usage (from the repo root, after `python onnx_embeddings.py prepare`):
+    python benchmarks/bench_embedding_backends.py
+    python benchmarks/bench_embedding_backends.py --limit 2000 --k 15
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from vector_store import create_embedding_function  # noqa: E402
+
+DEFAULT_QUERIES = [
+    "Inflation outlook",
+    "Sunway healthcare listing",
+    "Press Metal aluminium prices",
+    "dividend snowball strategy",
+    "semiconductor recovery Vitrox",
+    "REIT rental reversion",
+    "target price and recommendation",
+    "半导体 复苏",
+    "如何 用 小资金 投资",
+    "market support and resistance levels",
+]
+
+
+def load_units(limit):
+    texts = []
+    for path in sorted(glob.glob(os.path.join(REPO_ROOT, "data", "*", "processed", "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f).get("data", [])
+        if not isinstance(items, list):
+            continue
+        for item in items:
+            text = item.get("text", "") if isinstance(item, dict) else ""
+            if text and len(text) >= 5:
+                texts.append(text)
+    return texts[:limit] if limit else texts
+
+
+def timed_embed(ef, texts):
+    ef(texts[:8])  # Warm-up (model load, first-call allocations)
+    start = time.perf_counter()
+    vectors = np.asarray(ef(texts), dtype=np.float32)
+    elapsed = time.perf_counter() - start
+    return vectors, elapsed
+
+
+def normalize(m):
+    return m / np.clip(np.linalg.norm(m, axis=1, keepdims=True), 1e-12, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends.")
+    parser.add_argument("--limit", type=int, default=0, help="Max units to embed (0 = all)")
+    parser.add_argument("--k", type=int, default=10, help="Top-k for the agreement check")
+    parser.add_argument("--queries", help="Optional text file with one query per line")
+    args = parser.parse_args()
+
+    texts = load_units(args.limit)
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    print(f"📋 {len(texts)} units, {len(queries)} queries, k={args.k}")
+
+    results = {}
+    for backend in ("sentence-transformers", "onnx-int8"):
+        print(f"⚙️  Embedding with {backend}...")
+        ef = create_embedding_function(backend)
+        doc_vecs, elapsed = timed_embed(ef, texts)
+        query_vecs = np.asarray(ef(queries), dtype=np.float32)
+        results[backend] = (normalize(doc_vecs), normalize(query_vecs), elapsed)
+        print(f"   {len(texts) / elapsed:,.1f} units/s ({elapsed:.2f}s)")
+
+    torch_docs, torch_queries, torch_s = results["sentence-transformers"]
+    onnx_docs, onnx_queries, onnx_s = results["onnx-int8"]
+
+    pair_cosine = float(np.mean(np.sum(torch_docs * onnx_docs, axis=1)))
+
+    k = min(args.k, len(texts))
+    overlaps = []
+    for q_t, q_o in zip(torch_queries, onnx_queries):
+        top_t = set(np.argpartition(-(torch_docs @ q_t), k - 1)[:k])
+        top_o = set(np.argpartition(-(onnx_docs @ q_o), k - 1)[:k])
+        overlaps.append(len(top_t & top_o) / k)
+
+    print("\n" + "=" * 50)
+    print(f"Speed-up (onnx-int8 vs torch): {torch_s / onnx_s:.2f}x")
+    print(f"Mean cosine(torch, onnx) per unit: {pair_cosine:.4f}")
+    print(f"Top-{k} overlap: mean {np.mean(overlaps):.3f}, min {np.min(overlaps):.3f}")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+NumPy exact search vs. Chroma HNSW (fully offline, no LLM calls).
+
+Copies a frozen snapshot (see bench_retrieval.py freeze) to a temp dir,
+builds the NumPy index there and runs the labelled queries through
+vector_store.search / search_batch with RETRIEVAL_BACKEND=chroma and =numpy:
+  - recall@k / MRR against the labels (same scoring as bench_retrieval.py)
+  - top-k agreement: |chroma top-k ∩ numpy top-k| / k (numpy is exact, so
+    this is effectively Chroma's HNSW recall)
+  - p50/p99 latency per question, and batched throughput via search_batch
+
+Usage (from the repo root):
+    python benchmarks/bench_numpy_backend.py
+    python benchmarks/bench_numpy_backend.py --snapshot baseline --n 5 15 --repeat 5
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_retrieval import DEFAULT_QUERIES, SNAPSHOT_DIR, load_labelled_queries, score  # noqa: E402
+
+BACKENDS = ("chroma", "numpy")
+STRATEGIES = ("none", "where")
+
+
+def run_one(vector_store, question, n, embedding, prefilter, generation):
+    results = vector_store.search(question["source_type"], question["query"], n, query_embedding=embedding,
+                                  prefilter=prefilter, generation=generation)
+    return (results["ids"][0] if results["ids"] else []), (results["metadatas"][0] if results["metadatas"] else [])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the NumPy exact backend with Chroma.")
+    parser.add_argument("--snapshot", default="baseline")
+    parser.add_argument("--queries", default=DEFAULT_QUERIES)
+    parser.add_argument("--n", type=int, nargs="+", default=[5, 15])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    snapshot = os.path.join(SNAPSHOT_DIR, args.snapshot)
+    if not os.path.isdir(snapshot):
+        print(f"❌ No snapshot '{args.snapshot}'. Create one with: python benchmarks/bench_retrieval.py freeze")
+        return
+
+    with tempfile.TemporaryDirectory(prefix="bench_numpy_") as tmp:
+        db = os.path.join(tmp, "chroma_db")
+        shutil.copytree(snapshot, db)
+
+        import vector_store
+        import numpy_index
+        vector_store.DB_PATH = db
+        generation = vector_store.active_generation()
+
+        start = time.perf_counter()
+        numpy_index.build(generation["collection"])
+        print(f"⏱️ Index build: {time.perf_counter() - start:.2f}s")
+
+        questions = load_labelled_queries(args.queries)
+        ef = vector_store.get_embedding_function(generation["model"])
+        embeddings = ef([q["query"] for q in questions])
+        print(f"📋 {len(questions)} labelled queries, k={args.n}")
+
+        rows, top_ids = [], {}
+        for backend in BACKENDS:
+            os.environ["RETRIEVAL_BACKEND"] = backend
+            # Warm-up: load collections / the memmap before timing
+            for question, embedding in zip(questions, embeddings):
+                run_one(vector_store, question, 1, embedding, False, generation)
+
+            for strategy in STRATEGIES:
+                prefilter = strategy == "where"
+                for n in args.n:
+                    latencies, recalls, rrs = [], [], []
+                    for rep in range(args.repeat):
+                        for i, (question, embedding) in enumerate(zip(questions, embeddings)):
+                            t0 = time.perf_counter()
+                            ids, metadatas = run_one(vector_store, question, n, embedding, prefilter, generation)
+                            latencies.append((time.perf_counter() - t0) * 1000)
+                            if rep == 0:
+                                recall, rr = score(question["relevant"], metadatas, n)
+                                recalls.append(recall)
+                                rrs.append(rr)
+                                top_ids[(backend, strategy, n, i)] = ids
+
+                    # Batched: every question of a source type in one search_batch call
+                    t0 = time.perf_counter()
+                    for source_type in vector_store.SOURCE_TYPES:
+                        picked = [i for i, q in enumerate(questions) if q["source_type"] == source_type]
+                        if picked:
+                            vector_store.search_batch(source_type, [questions[i]["query"] for i in picked], n,
+                                                      query_embeddings=[embeddings[i] for i in picked],
+                                                      prefilter=prefilter, generation=generation)
+                    batch_ms = (time.perf_counter() - t0) * 1000 / len(questions)
+
+                    rows.append({
+                        "backend": backend, "strategy": strategy, "k": n,
+                        "recall": np.mean(recalls), "mrr": np.mean(rrs),
+                        "p50": np.percentile(latencies, 50), "p99": np.percentile(latencies, 99),
+                        "batch": batch_ms,
+                    })
+
+    print("\n" + "=" * 86)
+    print(f"{'backend':<8} {'strategy':<9} {'k':>4} {'recall@k':>9} {'MRR':>7} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'batched ms/q':>13} {'agree@k':>8}")
+    print("-" * 86)
+    for r in rows:
+        agree = ""
+        if r["backend"] == "chroma":
+            overlaps = []
+            for i in range(len(questions)):
+                a = set(top_ids[("chroma", r["strategy"], r["k"], i)])
+                b = set(top_ids[("numpy", r["strategy"], r["k"], i)])
+                if b:
+                    overlaps.append(len(a & b) / len(b))
+            agree = f"{np.mean(overlaps):.3f}" if overlaps else "-"
+        print(f"{r['backend']:<8} {r['strategy']:<9} {r['k']:>4} {r['recall']:>9.3f} {r['mrr']:>7.3f} "
+              f"{r['p50']:>8.2f} {r['p99']:>8.2f} {r['batch']:>13.2f} {agree:>8}")
+    print("=" * 86)
+    print("agree@k: share of the exact (numpy) top-k that Chroma's HNSW also returned.")
+
+
+if __name__ == "__main__":
+    main()
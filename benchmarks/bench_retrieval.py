@@ -0,0 +1,355 @@
+"""
+Retrieval quality vs. latency benchmark (fully offline, no LLM calls).
+
+Runs the labelled questions in benchmarks/retrieval_queries.jsonl against a
+frozen snapshot of chroma_db and reports, for every configuration:
+  - recall@k: share of a question's relevant sources found in the top k
+  - MRR:      mean of 1 / rank of the first relevant unit (0 if none in the top k)
+  - p50/p99:  retrieval latency per question (the query embedding is computed
+              once up front and reported separately as embed ms/q)
+
+Swept dimensions:
+  - k (n_results): app.py uses 5, rag_agent.py uses 15
+  - HNSW search_ef (0 = whatever the snapshot was built with)
+  - filter strategy:
+      none       -> plain vector search, no entity/date filter
+      where      -> entity/date `where` clause pushed into Chroma, relaxed
+                    when nothing matches (vector_store.search)
+      postfilter -> unfiltered search fetching POSTFILTER_OVERFETCH x k, then
+                    the same entity/date filter applied in Python
+  - collection layout (shared / partitioned), whichever the snapshot contains
+
+Relevance is labelled per source file (origin_source, plus the `sources` list
+near_dedup.py keeps on folded units), so the labels survive re-ingests that
+change unit ids.
+
+Every search_ef value runs in a fresh interpreter against a throwaway copy of
+the snapshot: the HNSW parameters are read when a collection is first loaded,
+and the frozen snapshot itself is never modified.
+
+Usage (from the repo root):
+    python benchmarks/bench_retrieval.py freeze                  # copy ./chroma_db -> benchmarks/snapshots/baseline
+    python benchmarks/bench_retrieval.py run
+    python benchmarks/bench_retrieval.py run --n 5 15 --ef 0 16 64 --strategies none where
+    python benchmarks/bench_retrieval.py run --snapshot minilm-int8 --output bench_retrieval.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+BENCH_DIR = os.path.join(REPO_ROOT, "benchmarks")
+SNAPSHOT_DIR = os.path.join(BENCH_DIR, "snapshots")
+DEFAULT_QUERIES = os.path.join(BENCH_DIR, "retrieval_queries.jsonl")
+DEFAULT_N = [5, 10, 15, 30]
+DEFAULT_EF = [0, 16, 50, 100, 200]
+STRATEGIES = ("none", "where", "postfilter")
+POSTFILTER_OVERFETCH = 4
+RESULT_PREFIX = "RESULT "
+
+
+# --- SNAPSHOTS ---
+def _tree_digest(path):
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name == "manifest.json":
+                continue
+            full = os.path.join(root, name)
+            digest.update(os.path.relpath(full, path).encode("utf-8"))
+            with open(full, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def freeze(name, source, force=False):
+    """
+    Copies the live vector store into benchmarks/snapshots/<name> with a
+    manifest, so later runs compare configurations on identical data.
+    """
+    import vector_store
+
+    vector_store.DB_PATH = source
+    target = os.path.join(SNAPSHOT_DIR, name)
+    if os.path.exists(target):
+        if not force:
+            print(f"❌ Snapshot '{name}' already exists (use --force to replace it).")
+            return
+        shutil.rmtree(target)
+
+    shutil.copytree(source, target)
+    manifest = {
+        "name": name,
+        "source": os.path.abspath(source),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "embedding_model": vector_store.active_generation()["model"],
+        "digest": _tree_digest(target),
+    }
+    with open(os.path.join(target, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+    print(f"🧊 Frozen {source} -> {target} (digest {manifest['digest']})")
+
+
+# --- LABELS & METRICS ---
+def load_labelled_queries(path):
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                questions.append(json.loads(line))
+    return questions
+
+
+def unit_sources(meta):
+    meta = meta or {}
+    sources = {s for s in (meta.get("sources") or "").split(",") if s}
+    if meta.get("origin_source"):
+        sources.add(meta["origin_source"])
+    return sources
+
+
+def score(relevant, metadatas, k):
+    """
+    (recall@k, reciprocal rank) for one question.
+    """
+    relevant = set(relevant)
+    found, reciprocal_rank = set(), 0.0
+    for rank, meta in enumerate(metadatas[:k], start=1):
+        hits = unit_sources(meta) & relevant
+        if hits:
+            found |= hits
+            if not reciprocal_rank:
+                reciprocal_rank = 1.0 / rank
+    return len(found) / len(relevant), reciprocal_rank
+
+
+# --- WORKER (one interpreter per search_ef value) ---
+def _matches(where, meta):
+    """
+    Evaluates the subset of Chroma's where syntax build_where() produces.
+    """
+    if not where:
+        return True
+    if "$and" in where:
+        return all(_matches(clause, meta) for clause in where["$and"])
+    if "$or" in where:
+        return any(_matches(clause, meta) for clause in where["$or"])
+
+    (key, condition), = where.items()
+    value = (meta or {}).get(key)
+    if not isinstance(condition, dict):
+        return value == condition
+    (op, target), = condition.items()
+    if value is None:
+        return False
+    if op == "$gte":
+        return value >= target
+    if op == "$lte":
+        return value <= target
+    if op == "$ne":
+        return value != target
+    return value == target
+
+
+def _postfilter(vector_store, source_type, query, n, embedding):
+    wide = vector_store.query_source(source_type, n * POSTFILTER_OVERFETCH, query_embeddings=[embedding])
+    metadatas = wide["metadatas"][0] if wide["metadatas"] else []
+    for where in vector_store._filter_attempts(query, prefilter=True):
+        kept = [m for m in metadatas if _matches(where, m)]
+        if kept:
+            return kept[:n]
+    return metadatas[:n]
+
+
+def run_strategy(vector_store, strategy, question, n, embedding):
+    """
+    Metadatas of the top-n units for one question under one filter strategy.
+    """
+    source_type, query = question["source_type"], question["query"]
+    if strategy == "postfilter":
+        return _postfilter(vector_store, source_type, query, n, embedding)
+    results = vector_store.search(source_type, query, n, query_embedding=embedding,
+                                  prefilter=(strategy == "where"))
+    return results["metadatas"][0] if results["metadatas"] else []
+
+
+def available_layouts(vector_store):
+    base = vector_store.active_generation()["collection"]
+    names = [getattr(c, "name", c) for c in vector_store.get_client().list_collections()]
+    layouts = []
+    if base in names:
+        layouts.append("shared")
+    if any(n.startswith(base + vector_store.PARTITION_SEPARATOR) for n in names):
+        layouts.append("partitioned")
+    return layouts
+
+
+def set_search_ef(vector_store, names, value):
+    client = vector_store.get_client()
+    for name in names:
+        collection = client.get_collection(name)
+        try:
+            # chromadb >= 1.0 keeps HNSW settings in the collection configuration
+            collection.modify(configuration={"hnsw": {"ef_search": value}})
+        except (TypeError, ValueError):
+            # Older releases read them from metadata (and refuse to change the space)
+            metadata = {k: v for k, v in (collection.metadata or {}).items() if k != "hnsw:space"}
+            metadata["hnsw:search_ef"] = value
+            collection.modify(metadata=metadata)
+
+
+def worker(args):
+    import vector_store
+
+    vector_store.DB_PATH = args.db
+    questions = load_labelled_queries(args.queries)
+    layouts = [l for l in available_layouts(vector_store) if not args.layouts or l in args.layouts]
+
+    for layout in layouts:
+        os.environ["COLLECTION_LAYOUT"] = layout
+        names = vector_store.layout_collections()
+        if args.ef:
+            set_search_ef(vector_store, names, args.ef)
+
+        ef = vector_store.get_embedding_function()
+        ef(["warm up"])
+        start = time.perf_counter()
+        embeddings = ef([q["query"] for q in questions])
+        embed_ms = (time.perf_counter() - start) * 1000 / len(questions)
+
+        # Load every collection/segment before timing anything
+        for question, embedding in zip(questions, embeddings):
+            run_strategy(vector_store, "none", question, 1, embedding)
+
+        for strategy in args.strategies:
+            for n in args.n:
+                latencies, recalls, reciprocal_ranks = [], [], []
+                for rep in range(args.repeat):
+                    for question, embedding in zip(questions, embeddings):
+                        start = time.perf_counter()
+                        metadatas = run_strategy(vector_store, strategy, question, n, embedding)
+                        latencies.append((time.perf_counter() - start) * 1000)
+                        if rep == 0:
+                            recall, rr = score(question["relevant"], metadatas, n)
+                            recalls.append(recall)
+                            reciprocal_ranks.append(rr)
+
+                row = {
+                    "layout": layout,
+                    "strategy": strategy,
+                    "search_ef": args.ef or "default",
+                    "k": n,
+                    "recall": float(np.mean(recalls)),
+                    "mrr": float(np.mean(reciprocal_ranks)),
+                    "p50_ms": float(np.percentile(latencies, 50)),
+                    "p99_ms": float(np.percentile(latencies, 99)),
+                    "embed_ms": embed_ms,
+                    "queries": len(questions),
+                }
+                print(RESULT_PREFIX + json.dumps(row), flush=True)
+
+
+# --- DRIVER ---
+def run(args):
+    snapshot = os.path.join(SNAPSHOT_DIR, args.snapshot)
+    if not os.path.isdir(snapshot):
+        print(f"❌ No snapshot '{args.snapshot}'. Create one with: python benchmarks/bench_retrieval.py freeze")
+        return
+
+    manifest_path = os.path.join(snapshot, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    print(f"🧊 Snapshot {args.snapshot} (digest {manifest.get('digest', '?')}, "
+          f"model {manifest.get('embedding_model', '?')})")
+    print(f"📋 {len(load_labelled_queries(args.queries))} labelled queries, "
+          f"k={args.n}, search_ef={args.ef}, strategies={args.strategies}")
+
+    rows = []
+    for ef in args.ef:
+        with tempfile.TemporaryDirectory(prefix="bench_retrieval_") as tmp:
+            db = os.path.join(tmp, "chroma_db")
+            shutil.copytree(snapshot, db)
+            cmd = [sys.executable, os.path.abspath(__file__), "_worker", "--db", db, "--ef", str(ef),
+                   "--queries", args.queries, "--repeat", str(args.repeat),
+                   "--n", *map(str, args.n), "--strategies", *args.strategies]
+            if args.layouts:
+                cmd += ["--layouts", *args.layouts]
+            proc = subprocess.run(cmd, capture_output=True, text=True, cwd=REPO_ROOT)
+
+        found = [json.loads(line[len(RESULT_PREFIX):]) for line in proc.stdout.splitlines()
+                 if line.startswith(RESULT_PREFIX)]
+        if proc.returncode != 0 or not found:
+            print(f"❌ search_ef={ef} failed:\n{proc.stderr.strip()[-2000:]}")
+            continue
+        rows.extend(found)
+        print(f"   ✅ search_ef={ef or 'default'}: {len(found)} configurations")
+
+    if not rows:
+        return
+
+    print("\n" + "=" * 92)
+    print(f"{'layout':<12} {'strategy':<11} {'search_ef':>9} {'k':>4} {'recall@k':>9} {'MRR':>7} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'embed ms/q':>11}")
+    print("-" * 92)
+    for r in sorted(rows, key=lambda r: (r["layout"], r["strategy"], str(r["search_ef"]), r["k"])):
+        print(f"{r['layout']:<12} {r['strategy']:<11} {str(r['search_ef']):>9} {r['k']:>4} "
+              f"{r['recall']:>9.3f} {r['mrr']:>7.3f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['embed_ms']:>11.2f}")
+    print("=" * 92)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"snapshot": manifest or {"name": args.snapshot}, "results": rows}, f, indent=4)
+        print(f"💾 Results written to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval quality vs. latency benchmark.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_freeze = sub.add_parser("freeze", help="Snapshot the live vector store")
+    p_freeze.add_argument("--name", default="baseline")
+    p_freeze.add_argument("--source", default=os.path.join(REPO_ROOT, "chroma_db"))
+    p_freeze.add_argument("--force", action="store_true", help="Replace an existing snapshot")
+
+    for name in ("run", "_worker"):
+        p = sub.add_parser(name, help="Run the sweep" if name == "run" else argparse.SUPPRESS)
+        p.add_argument("--queries", default=DEFAULT_QUERIES, help="Labelled query set (JSONL)")
+        p.add_argument("--n", type=int, nargs="+", default=DEFAULT_N, help="n_results values (k)")
+        p.add_argument("--strategies", nargs="+", choices=STRATEGIES, default=list(STRATEGIES))
+        p.add_argument("--layouts", nargs="+", choices=("shared", "partitioned"),
+                       help="Default: every layout present in the snapshot")
+        p.add_argument("--repeat", type=int, default=3, help="Timed passes over the query set")
+        if name == "run":
+            p.add_argument("--snapshot", default="baseline")
+            p.add_argument("--ef", type=int, nargs="+", default=DEFAULT_EF,
+                           help="HNSW search_ef values (0 = snapshot default)")
+            p.add_argument("--output", help="Optional JSON file for the results")
+        else:
+            p.add_argument("--db", required=True)
+            p.add_argument("--ef", type=int, default=0)
+
+    args = parser.parse_args()
+    if args.command == "freeze":
+        freeze(args.name, args.source, force=args.force)
+    elif args.command == "run":
+        run(args)
+    else:
+        worker(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Startup benchmark for the CLI entry points.
+
+Each entry point is imported in a fresh interpreter (so nothing is cached
+between runs) and we time two things:
+  - import: `import <module>` finished (what `--help`-style runs pay)
+  - ready:  the module's heavy resources are initialised and usable
+
+Usage (from the repo root):
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeat 5 --only ingest_vectors rag_agent
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module -> code that brings it to "ready to serve"
+ENTRY_POINTS = {
+    "ingest_vectors": "import vector_store; vector_store.get_collection()",
+    "batch_processor": "mod.get_client()",
+    "pipeline_watcher": "mod.PipelineHandler()",
+    "rag_agent": "import vector_store; vector_store.get_collection(create=False); mod.get_gemini_client()",
+}
+
+CHILD_TEMPLATE = """
+import json, resource, time, importlib
+t0 = time.perf_counter()
+mod = importlib.import_module({module!r})
+t_import = time.perf_counter() - t0
+rss_import = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+error = None
+try:
+    {ready}
+except Exception as e:
+    error = repr(e)
+t_ready = time.perf_counter() - t0
+rss_ready = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"import_s": t_import, "ready_s": t_ready,
+                  "rss_import_mb": rss_import / 1024, "rss_ready_mb": rss_ready / 1024,
+                  "error": error}}))
+"""
+
+
+def run_once(module, ready):
+    code = CHILD_TEMPLATE.format(module=module, ready=ready)
+    proc = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        last_line = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "unknown error"
+        return {"error": last_line}
+    # The module may print its own banners; the result is always the last line.
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-to-ready time per entry point.")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per entry point")
+    parser.add_argument("--only", nargs="*", help="Subset of entry points to run")
+    args = parser.parse_args()
+
+    modules = args.only or list(ENTRY_POINTS)
+
+    print(f"{'entry point':<18} {'import (s)':>10} {'ready (s)':>10} {'RSS import':>11} {'RSS ready':>10}")
+    print("-" * 64)
+    for module in modules:
+        runs = [run_once(module, ENTRY_POINTS[module]) for _ in range(args.repeat)]
+        ok = [r for r in runs if "import_s" in r]
+        if not ok:
+            print(f"{module:<18} ❌ {runs[0]['error']}")
+            continue
+
+        import_s = statistics.median(r["import_s"] for r in ok)
+        ready_s = statistics.median(r["ready_s"] for r in ok)
+        rss_import = statistics.median(r["rss_import_mb"] for r in ok)
+        rss_ready = statistics.median(r["rss_ready_mb"] for r in ok)
+        print(f"{module:<18} {import_s:>10.3f} {ready_s:>10.3f} {rss_import:>9.0f}MB {rss_ready:>8.0f}MB")
+
+        errors = {r["error"] for r in ok if r.get("error")}
+        for err in errors:
+            print(f"{'':<18} ⚠️ ready step failed: {err}")
+
+
+if __name__ == "__main__":
+    main()
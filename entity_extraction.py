@@ -0,0 +1,391 @@
+"""
+Lightweight, local entity + date extraction (no LLM, no extra dependencies).
+
+Used in two places:
+  - ingest: tag each unit with normalized Bursa tickers and a publication date
+  - retrieval: detect tickers / time ranges in the question and turn them into
+    Chroma `where` filters so the search only looks at matching units
+    (only unambiguous ones: see AMBIGUOUS_ALIASES and parse_date_range)
+"""
+import calendar
+import datetime
+import re
+
+# --- BURSA ENTITY DICTIONARY ---
+# stock code -> (canonical name, aliases). Aliases cover the English name,
+# the Bursa short name, the Bloomberg ticker and common Chinese names.
+# Short ALL-CAPS aliases (<= 4 chars) are matched case-sensitively so words
+# like "misc" or "ql" in normal text don't trigger a match.
+BURSA_ENTITIES = {
+    "1155": ("Maybank", ["Maybank", "Malayan Banking", "MAY MK", "马银行", "馬銀行"]),
+    "1295": ("Public Bank", ["Public Bank", "PBBANK", "PBK MK", "大众银行", "大眾銀行"]),
+    "1023": ("CIMB", ["CIMB", "CIMB Group", "联昌", "聯昌"]),
+    "5819": ("Hong Leong Bank", ["Hong Leong Bank", "HLBANK", "丰隆银行", "豐隆銀行"]),
+    "1066": ("RHB Bank", ["RHB", "RHB Bank", "RHBBANK"]),
+    "1015": ("AMMB", ["AMMB", "AmBank", "大马银行"]),
+    "5258": ("Bank Islam", ["Bank Islam", "BIMB"]),
+    "1818": ("Bursa Malaysia", ["Bursa Malaysia Bhd", "BURSA MK"]),
+    "5347": ("Tenaga Nasional", ["Tenaga Nasional", "Tenaga", "TNB", "国家能源", "國家能源"]),
+    "6742": ("YTL Power", ["YTL Power", "YTLPOWR"]),
+    "4677": ("YTL Corp", ["YTL Corp", "YTL Corporation", "杨忠礼"]),
+    "5211": ("Sunway", ["Sunway", "Sunway Bhd", "SWB MK", "双威", "雙威"]),
+    "5263": ("Sunway Construction", ["Sunway Construction", "SunCon", "SUNCON"]),
+    "5176": ("Sunway REIT", ["Sunway REIT", "SUNREIT"]),
+    "3336": ("IJM", ["IJM", "IJM Corp"]),
+    "5398": ("Gamuda", ["Gamuda", "金务大", "金務大"]),
+    "8869": ("Press Metal", ["Press Metal", "Press Metal Aluminium", "PMETAL", "PMAH MK", "齐力", "齊力"]),
+    "5227": ("IGB REIT", ["IGB REIT", "IGBREIT"]),
+    "5053": ("OSK Holdings", ["OSK Holdings", "OSK"]),
+    "0222": ("Optimax", ["Optimax", "OPTIMAX MK"]),
+    "0097": ("ViTrox", ["ViTrox", "Vitrox"]),
+    "0166": ("Inari Amertron", ["Inari", "Inari Amertron"]),
+    "0138": ("MyEG", ["MyEG", "MYEG", "MY E.G."]),
+    "7081": ("Pharmaniaga", ["Pharmaniaga"]),
+    "7106": ("Supermax", ["Supermax", "SUPERMX"]),
+    "7113": ("Top Glove", ["Top Glove", "TOPGLOV", "顶级手套", "頂級手套"]),
+    "5168": ("Hartalega", ["Hartalega", "HARTA"]),
+    "7153": ("Kossan", ["Kossan"]),
+    "7233": ("Dufu", ["Dufu"]),
+    "7084": ("QL Resources", ["QL Resources", "QL"]),
+    "7103": ("Spritzer", ["Spritzer"]),
+    "5326": ("99 Speed Mart", ["99 Speedmart", "99 Speed Mart", "99SMART"]),
+    "4707": ("Nestle Malaysia", ["Nestle", "Nestlé"]),
+    "5296": ("MR DIY", ["MR DIY", "MRDIY"]),
+    "7052": ("Padini", ["Padini"]),
+    "4715": ("Genting Malaysia", ["Genting Malaysia", "GENM", "云顶大马", "雲頂大馬"]),
+    "3182": ("Genting", ["Genting Bhd", "Genting Berhad", "云顶", "雲頂"]),
+    "6947": ("CelcomDigi", ["CelcomDigi", "Digi", "Celcom"]),
+    "6012": ("Maxis", ["Maxis"]),
+    "6888": ("Axiata", ["Axiata"]),
+    "4863": ("Telekom Malaysia", ["Telekom Malaysia", "TM"]),
+    "6399": ("Astro Malaysia", ["Astro Malaysia", "ASTRO"]),
+    "5183": ("Petronas Chemicals", ["Petronas Chemicals", "PCHEM"]),
+    "6033": ("Petronas Gas", ["Petronas Gas", "PETGAS"]),
+    "5681": ("Petronas Dagangan", ["Petronas Dagangan", "PETDAG"]),
+    "3816": ("MISC", ["MISC"]),
+    "7277": ("Dialog", ["Dialog Group", "Dialog"]),
+    "5225": ("IHH Healthcare", ["IHH Healthcare", "IHH"]),
+    "1961": ("IOI Corp", ["IOI Corp", "IOI Corporation", "IOICORP"]),
+    "2445": ("KLK", ["Kuala Lumpur Kepong", "KLK"]),
+    "5285": ("SD Guthrie", ["SD Guthrie", "Sime Darby Plantation"]),
+    "4197": ("Sime Darby", ["Sime Darby"]),
+    "4065": ("PPB Group", ["PPB Group"]),
+    "5038": ("KSL Holdings", ["KSL Holdings", "KSL"]),
+}
+
+# Aliases that are also everyday English/Malay words ("dialog", "harta" =
+# property, "tenaga" = energy). Matched case-sensitively, and in a question
+# they only become a hard filter next to a stock context word (see query_entities).
+AMBIGUOUS_ALIASES = {"Dialog", "HARTA", "Tenaga", "Digi", "Spritzer"}
+_STOCK_CONTEXT = re.compile(
+    r"\b(?:stocks?|shares?|bhd|berhad|counters?|tickers?|saham|target price|tp|dividends?|earnings|"
+    r"results|valuation|bursa|klse)\b|股|\.kl\b",
+    re.IGNORECASE,
+)
+
+_MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+_MONTHS["sept"] = 9
+_CN_QUARTERS = {"一": 1, "二": 2, "三": 3, "四": 4, "1": 1, "2": 2, "3": 3, "4": 4}
+
+
+def _is_case_sensitive(alias):
+    return alias.isupper() and len(alias.replace(" ", "")) <= 4
+
+
+def _has_cjk(text):
+    return any("一" <= ch <= "鿿" for ch in text)
+
+
+def _build_matchers():
+    insensitive, sensitive, cjk = {}, {}, {}
+    for code, (_, aliases) in BURSA_ENTITIES.items():
+        for alias in aliases:
+            if _has_cjk(alias):
+                cjk[alias] = code
+            elif _is_case_sensitive(alias) or alias in AMBIGUOUS_ALIASES:
+                sensitive[alias] = code
+            else:
+                insensitive[alias.lower()] = code
+
+    def compile_alternation(aliases, flags=0):
+        if not aliases:
+            return None
+        # Longest first so "Sunway REIT" wins over "Sunway"
+        parts = sorted(aliases, key=len, reverse=True)
+        pattern = r"(?<![A-Za-z0-9])(" + "|".join(re.escape(a) for a in parts) + r")(?![A-Za-z0-9])"
+        return re.compile(pattern, flags)
+
+    return (
+        (compile_alternation(insensitive, re.IGNORECASE), insensitive),
+        (compile_alternation(sensitive), sensitive),
+        sorted(cjk.items(), key=lambda kv: len(kv[0]), reverse=True),
+    )
+
+
+_INSENSITIVE, _SENSITIVE, _CJK_ALIASES = _build_matchers()
+# Stock codes only count when written like one: "(5211)" or "5211.KL"
+_CODE_PATTERN = re.compile(r"\((\d{4})\)|\b(\d{4})\.KL\b")
+
+
+def _match(text):
+    """
+    {code: True if matched by an unambiguous alias / stock code, else False}.
+    """
+    found = {}
+    if not text:
+        return found
+
+    def add(code, alias):
+        found[code] = found.get(code, False) or alias not in AMBIGUOUS_ALIASES
+
+    regex, lookup = _INSENSITIVE
+    if regex:
+        for m in regex.finditer(text):
+            add(lookup[m.group(1).lower()], m.group(1))
+
+    regex, lookup = _SENSITIVE
+    if regex:
+        for m in regex.finditer(text):
+            add(lookup[m.group(1)], m.group(1))
+
+    remaining = text
+    for alias, code in _CJK_ALIASES:
+        if alias in remaining:
+            add(code, alias)
+            # Blank it out so "云顶大马" doesn't also count as "云顶"
+            remaining = remaining.replace(alias, " ")
+
+    for m in _CODE_PATTERN.finditer(text):
+        code = m.group(1) or m.group(2)
+        if code in BURSA_ENTITIES:
+            found[code] = True
+
+    return found
+
+
+def match_entities(text):
+    """
+    Returns the sorted list of Bursa stock codes mentioned in the text.
+    """
+    return sorted(_match(text))
+
+
+def query_entities(query):
+    """
+    Splits the tickers in a question into (hard, soft). A ticker named only
+    through an ambiguous alias ("Dialog", "HARTA") is soft unless the question
+    also talks about stocks; soft tickers are not used as filters (the query
+    embedding already favours units that mention the name).
+    """
+    found = _match(query)
+    context = bool(_STOCK_CONTEXT.search(query or ""))
+    hard = sorted(code for code, strong in found.items() if strong or context)
+    soft = sorted(code for code, strong in found.items() if not (strong or context))
+    return hard, soft
+
+
+def normalize_entities(entities):
+    """
+    Normalizes a free-form entity list (e.g. from the LLM extraction) to stock codes.
+    """
+    codes = set()
+    for entity in entities or []:
+        if not isinstance(entity, str):
+            continue
+        entity = entity.strip()
+        if entity in BURSA_ENTITIES:
+            codes.add(entity)
+        else:
+            codes.update(match_entities(entity))
+    return sorted(codes)
+
+
+def entity_name(code):
+    return BURSA_ENTITIES.get(code, (code, []))[0]
+
+
+# --- DATES ---
+def parse_ymd(value):
+    """
+    Accepts '20251216', '2025-12-16', 20251216 -> 20251216 (int), else None.
+    """
+    if value is None:
+        return None
+    digits = re.sub(r"\D", "", str(value))[:8]
+    if len(digits) != 8:
+        return None
+    try:
+        datetime.date(int(digits[:4]), int(digits[4:6]), int(digits[6:8]))
+    except ValueError:
+        return None
+    return int(digits)
+
+
+def date_from_filename(filename):
+    """
+    Broker reports are named like Sunway_20260102_HLIB -> 20260102.
+    """
+    match = re.search(r"(?<!\d)(20\d{6})(?!\d)", filename or "")
+    return parse_ymd(match.group(1)) if match else None
+
+
+def _ymd(date):
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+def _month_range(year, month):
+    last_day = calendar.monthrange(year, month)[1]
+    return year * 10000 + month * 100 + 1, year * 10000 + month * 100 + last_day
+
+
+def _add_months(year, month, delta):
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def _quarter_range(year, quarter):
+    # Results for a quarter are published during the quarter and up to ~3
+    # months after it ends, so the window runs from quarter start to end + 3M.
+    start_month = (quarter - 1) * 3 + 1
+    end_year, end_month = _add_months(year, start_month + 2, 3)
+    return _month_range(year, start_month)[0], _month_range(end_year, end_month)[1]
+
+
+_FISCAL_YEAR = re.compile(r"\b(?:fy|financial year|fiscal year)\s*'?\d{2,4}\b")
+_PUBLISHED_YEARS = re.compile(
+    r"\b(?:published|released|posted|written|dated|reports?|articles?|videos?|news|coverage)\b"
+    r"[^0-9.?!]{0,20}?\b(?:(?P<since>since|after)\s+|(?:between|from|in|during|on)\s+)?"
+    r"(?P<start>20\d{2})(?:\s*(?:-|–|to|and|until|through)\s*(?P<end>20\d{2}))?(?!\d)"
+)
+
+
+def _full_year(text):
+    year = int(text)
+    return year + 2000 if year < 100 else year
+
+
+def parse_date_range(query, today=None):
+    """
+    Detects a time range in the question. Returns (start_ymd, end_ymd) or None.
+    Handles: Q3 2025 / 3Q25 / 2025年第三季度, December 2025 / 2025年12月,
+    'this/last week|month|year', 'today', and years or year ranges that are
+    explicitly about publication ("reports published in 2025", "videos from
+    2024 to 2025", "2025年发布"). A bare year or FY2026 is what the question is
+    about ("outlook for FY2026"), not when the answer was published: no filter.
+    """
+    if not query:
+        return None
+    today = today or datetime.date.today()
+    text = query.lower()
+
+    # Quarters
+    # (Calendar quarters only: "Q3 FY25" depends on the company's fiscal year)
+    m = re.search(r"\bq([1-4])\s*'?(\d{2}|\d{4})\b", text) \
+        or re.search(r"\b([1-4])q\s*'?(\d{2}|\d{4})\b", text)
+    if m:
+        return _quarter_range(_full_year(m.group(2)), int(m.group(1)))
+    m = re.search(r"\b(\d{4})\s*q([1-4])\b", text)
+    if m:
+        return _quarter_range(int(m.group(1)), int(m.group(2)))
+    m = re.search(r"(\d{4})\s*年?\s*第?([一二三四1-4])\s*季", query)
+    if m:
+        return _quarter_range(int(m.group(1)), _CN_QUARTERS[m.group(2)])
+
+    # Month + year
+    month_names = "|".join(sorted(_MONTHS, key=len, reverse=True))
+    m = re.search(rf"\b({month_names})\.?\s+(\d{{4}})\b", text)
+    if m:
+        return _month_range(int(m.group(2)), _MONTHS[m.group(1)])
+    m = re.search(r"(\d{4})\s*年\s*(\d{1,2})\s*月", query)
+    if m and 1 <= int(m.group(2)) <= 12:
+        return _month_range(int(m.group(1)), int(m.group(2)))
+
+    # Relative ranges
+    if "today" in text or "今天" in query:
+        return _ymd(today), _ymd(today)
+    if "this week" in text or "本周" in query or "这周" in query:
+        start = today - datetime.timedelta(days=today.weekday())
+        return _ymd(start), _ymd(today)
+    if "last week" in text or "上周" in query:
+        start = today - datetime.timedelta(days=today.weekday() + 7)
+        return _ymd(start), _ymd(start + datetime.timedelta(days=6))
+    if "this month" in text or "本月" in query or "这个月" in query:
+        return _month_range(today.year, today.month)[0], _ymd(today)
+    if "last month" in text or "上个月" in query:
+        year, month = _add_months(today.year, today.month, -1)
+        return _month_range(year, month)
+    if "this year" in text or "今年" in query:
+        return today.year * 10000 + 101, _ymd(today)
+    if "last year" in text or "去年" in query:
+        return (today.year - 1) * 10000 + 101, (today.year - 1) * 10000 + 1231
+
+    # Years, only with publication phrasing
+    text = _FISCAL_YEAR.sub(" ", text)
+    m = _PUBLISHED_YEARS.search(text)
+    if m:
+        start_year = int(m.group("start"))
+        if m.group("end"):
+            end_year = int(m.group("end"))
+            start_year, end_year = min(start_year, end_year), max(start_year, end_year)
+            return start_year * 10000 + 101, end_year * 10000 + 1231
+        if m.group("since"):
+            return start_year * 10000 + 101, _ymd(today)
+        return start_year * 10000 + 101, start_year * 10000 + 1231
+    m = re.search(r"(?<!\d)(20\d{2})\s*年\s*(?:以来)?\s*(?:发布|发表|出版)", query)
+    if m:
+        year = int(m.group(1))
+        return year * 10000 + 101, year * 10000 + 1231
+
+    return None
+
+
+# --- METADATA + FILTERS ---
+def ticker_key(code):
+    return f"ticker_{code}"
+
+
+def entity_metadata(codes, published_ymd=None):
+    """
+    Chroma metadata can't hold lists, so each ticker becomes its own boolean
+    key (ticker_5211=True) that `where` filters can test, plus a readable
+    comma-joined copy for display.
+    """
+    metadata = {}
+    if codes:
+        metadata["tickers"] = ",".join(codes)
+        for code in codes:
+            metadata[ticker_key(code)] = True
+    if published_ymd:
+        metadata["published_ymd"] = published_ymd
+        metadata["published_year"] = published_ymd // 10000
+    return metadata
+
+
+def parse_query_filters(query, today=None):
+    tickers, soft_tickers = query_entities(query)
+    return {
+        "tickers": tickers,
+        "soft_tickers": soft_tickers,   # informational only, never filtered on
+        "date_range": parse_date_range(query, today=today),
+    }
+
+
+def _combine(clauses, op):
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {op: clauses}
+
+
+def build_where(filters, use_tickers=True, use_dates=True):
+    """
+    Turns parse_query_filters() output into a Chroma where clause (or None).
+    """
+    clauses = []
+    if use_tickers and filters.get("tickers"):
+        clauses.append(_combine([{ticker_key(c): True} for c in filters["tickers"]], "$or"))
+    if use_dates and filters.get("date_range"):
+        start, end = filters["date_range"]
+        clauses.append({"published_ymd": {"$gte": start}})
+        clauses.append({"published_ymd": {"$lte": end}})
+    return _combine(clauses, "$and")
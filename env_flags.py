@@ -0,0 +1,17 @@
+"""
+On/off switches read from the environment (or a .env loaded before the call).
+"""
+import os
+
+FALSE_VALUES = ("0", "false", "no", "off")
+
+
+def env_flag(name, default):
+    """
+    Read at call time. Unset or empty -> default; 0/false/no/off -> False;
+    anything else -> True.
+    """
+    value = os.environ.get(name, "").strip().lower()
+    if not value:
+        return default
+    return value not in FALSE_VALUES
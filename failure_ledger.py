@@ -0,0 +1,202 @@
+"""
+Persistent failure ledger shared by the scrapers and the batch processor.
+
+Every failure is classified:
+  - permanent (transcripts disabled, video removed, model NOT_FOUND, ...)
+    -> negative-cached for PERMANENT_TTL, scans skip it without any request
+  - transient (rate limits, 503s, timeouts, bad JSON from the model, ...)
+    -> retried with exponential backoff; after MAX_TRANSIENT_ATTEMPTS it is
+       moved to the dead-letter list like a permanent failure
+
+Keys are namespaced strings: "video:<id>", "file:<path>", "model:<name>".
+
+Usage:
+    python failure_ledger.py list          # dead letters (permanent + exhausted)
+    python failure_ledger.py list --all    # everything, including pending retries
+    python failure_ledger.py retry KEY     # forget a failure so it is retried now
+    python failure_ledger.py purge         # clear the whole ledger
+"""
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+# --- CONFIGURATION ---
+LEDGER_PATH = "data/failure_ledger.sqlite"
+PERMANENT_TTL = 30 * 24 * 3600      # Re-check "permanent" failures monthly
+BACKOFF_BASE = 15 * 60              # First transient retry after 15 min
+BACKOFF_MAX = 24 * 3600             # ...doubling, capped at one day
+MAX_TRANSIENT_ATTEMPTS = 8
+
+PERMANENT = "permanent"
+TRANSIENT = "transient"
+DEAD = "dead"
+
+# Substrings (exception class names or messages) that will not fix themselves
+PERMANENT_MARKERS = (
+    "TranscriptsDisabled", "Subtitles are disabled",
+    "NoTranscriptFound", "No transcripts were found",
+    "VideoUnavailable", "Video unavailable", "VideoUnplayable",
+    "InvalidVideoId", "AgeRestricted", "NotTranslatable",
+    "NOT_FOUND",
+)
+PERMANENT_STATUS_CODES = (404,)
+TRANSIENT_STATUS_CODES = (429,)
+
+
+def _status_codes(error, text):
+    """
+    HTTP statuses of an error: the exception's own attribute if it has one,
+    else status numbers standing alone in the message (not inside a video
+    id, URL or path).
+    """
+    for attr in ("status_code", "code", "status"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return {value}
+    return {int(code) for code in re.findall(r"(?<![\w/.\-])([45]\d\d)(?![\w/.\-])", text)}
+
+
+def model_not_found(error):
+    """
+    True only when the API error itself says the model doesn't exist (its
+    status code or status). Never decided from message text: a bad LLM
+    response ("... line 1 column 404") must not retire a working model.
+    """
+    if isinstance(error, json.JSONDecodeError):
+        return False
+    code = getattr(error, "code", None)
+    status = getattr(error, "status", None)
+    return code == 404 or getattr(error, "status_code", None) == 404 or status == "NOT_FOUND"
+
+
+def classify(error):
+    """
+    Returns PERMANENT or TRANSIENT for an exception or error message.
+    """
+    if isinstance(error, json.JSONDecodeError):
+        # Malformed model output: another attempt/model may do better
+        return TRANSIENT
+    text = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+    statuses = _status_codes(error, text)
+    if statuses & set(TRANSIENT_STATUS_CODES) or "Too Many Requests" in text:
+        return TRANSIENT
+    if statuses & set(PERMANENT_STATUS_CODES) or any(marker in text for marker in PERMANENT_MARKERS):
+        return PERMANENT
+    return TRANSIENT
+
+
+class FailureLedger:
+    def __init__(self, path=LEDGER_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS failures (
+                    key TEXT PRIMARY KEY,
+                    stage TEXT,
+                    kind TEXT NOT NULL,
+                    error TEXT,
+                    attempts INTEGER NOT NULL,
+                    first_failed REAL NOT NULL,
+                    last_failed REAL NOT NULL,
+                    retry_after REAL NOT NULL
+                )
+            """)
+            self._conn.commit()
+
+    def should_skip(self, key, now=None):
+        """
+        True while the key is negative-cached or waiting out its backoff.
+        """
+        now = now or time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT retry_after FROM failures WHERE key = ?", (key,)).fetchone()
+        return bool(row) and now < row[0]
+
+    def record_failure(self, key, error, stage="", kind=None):
+        """
+        Records a failure and returns its (possibly escalated) kind.
+        """
+        now = time.time()
+        kind = kind or classify(error)
+        message = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+
+        with self._lock:
+            row = self._conn.execute("SELECT attempts, first_failed FROM failures WHERE key = ?", (key,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            first_failed = row[1] if row else now
+
+            if kind == TRANSIENT and attempts >= MAX_TRANSIENT_ATTEMPTS:
+                kind = DEAD
+            if kind == TRANSIENT:
+                retry_after = now + min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+            else:
+                retry_after = now + PERMANENT_TTL
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO failures "
+                "(key, stage, kind, error, attempts, first_failed, last_failed, retry_after) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, stage, kind, message[:500], attempts, first_failed, now, retry_after),
+            )
+            self._conn.commit()
+        return kind
+
+    def record_success(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM failures WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def entries(self, dead_only=True):
+        query = "SELECT key, stage, kind, attempts, last_failed, retry_after, error FROM failures"
+        if dead_only:
+            query += f" WHERE kind IN ('{PERMANENT}', '{DEAD}')"
+        with self._lock:
+            return self._conn.execute(query + " ORDER BY stage, key").fetchall()
+
+    def purge(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM failures")
+            self._conn.commit()
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+def get_ledger():
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = FailureLedger()
+    return _ledger
+
+
+def print_entries(dead_only=True):
+    rows = get_ledger().entries(dead_only=dead_only)
+    title = "Dead letters" if dead_only else "All tracked failures"
+    print(f"📋 {title}: {len(rows)}")
+    for key, stage, kind, attempts, last_failed, retry_after, error in rows:
+        last = time.strftime("%Y-%m-%d %H:%M", time.localtime(last_failed))
+        retry = time.strftime("%Y-%m-%d %H:%M", time.localtime(retry_after))
+        print(f"   [{kind:<9}] {key}  ({stage}, {attempts}x, last {last}, retry after {retry})")
+        print(f"               {error[:120]}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "list":
+        print_entries(dead_only="--all" not in sys.argv)
+    elif command == "retry" and len(sys.argv) > 2:
+        get_ledger().record_success(sys.argv[2])
+        print(f"🔁 {sys.argv[2]} will be retried on the next run.")
+    elif command == "purge":
+        get_ledger().purge()
+        print("🧹 Ledger cleared.")
+    else:
+        print(__doc__)
@@ -5,6 +5,8 @@ import yt_dlp
 from youtube_transcript_api import YouTubeTranscriptApi
 from youtube_transcript_api.formatters import TextFormatter
 
+from failure_ledger import PERMANENT, get_ledger
+
 # --- CONFIGURATION ---
 DATA_RAW_RETAIL = "./data/retail/scraped"
 DATA_RAW_INST = "./data/institutional/scraped"
@@ -31,6 +33,7 @@ def fetch_youtube_transcripts():
     }
 
     formatter = TextFormatter()
+    ledger = get_ledger()
 
     for url in TARGET_URLS:
         print(f"   Scanning Channel: {url}")
@@ -54,6 +57,7 @@ def fetch_youtube_transcripts():
                 continue
 
             # 2. Iterate through them
+            skipped_known = 0
             for i, video in enumerate(videos):
                 if not video: continue
                 
@@ -71,6 +75,12 @@ def fetch_youtube_transcripts():
                         print(f"      ⏭️  Skipped {i}/{total_videos} (Already downloaded)")
                     continue 
 
+                # --- NEGATIVE CACHE: SKIP KNOWN-UNFETCHABLE ---
+                ledger_key = f"video:{video_id}"
+                if ledger.should_skip(ledger_key):
+                    skipped_known += 1
+                    continue
+
                 # --- PROCESSING NEW FILE ---
                 print(f"   ⬇️  [{i+1}/{total_videos}] Fetching: {title}...")
                 
@@ -86,12 +96,20 @@ def fetch_youtube_transcripts():
                     
                     # C. Save
                     formatted_text = formatter.format_transcript(transcript)
-                    file_content = f"Title: {title}\nSource: YouTube ({video_id})\n\n{formatted_text}"
+                    header = f"Title: {title}\nSource: YouTube ({video_id})\n"
+                    # Flat scans don't always include the date; keep it when they do
+                    published = video.get('upload_date')
+                    if not published and video.get('timestamp'):
+                        published = time.strftime("%Y%m%d", time.gmtime(video['timestamp']))
+                    if published:
+                        header += f"Published: {published}\n"
+                    file_content = f"{header}\n{formatted_text}"
                     
                     with open(filepath, "w", encoding="utf-8") as f:
                         f.write(file_content)
                         
                     print(f"       ✅ Saved!")
+                    ledger.record_success(ledger_key)
                     
                     # D. SAFETY SLEEP (Randomized)
                     # 20s to 40s is the safe zone for bulk downloading
@@ -101,14 +119,20 @@ def fetch_youtube_transcripts():
                     
                 except Exception as e:
                     print(f"       ⚠️ Failed: {e}")
-                    # If it's a 'TranscriptsDisabled' error, we just move on fast.
+                    kind = ledger.record_failure(ledger_key, e, stage="fetch_data")
+                    # Permanent (e.g. 'TranscriptsDisabled'): cached, move on immediately.
                     # If it's a network error, we wait a bit.
                     if "Too Many Requests" in str(e):
                         print("       🛑 RATE LIMIT HIT. Sleeping 5 minutes...")
                         time.sleep(300)
+                    elif kind == PERMANENT:
+                        print("       🚫 Permanent failure - won't retry for a while.")
                     else:
                         time.sleep(2) # Short pause for minor errors
 
+            if skipped_known:
+                print(f"   🚫 Skipped {skipped_known} videos known to be unfetchable (see failure_ledger.py list)")
+
 def main_loop():
     os.makedirs(DATA_RAW_RETAIL, exist_ok=True)
     os.makedirs(DATA_RAW_INST, exist_ok=True)
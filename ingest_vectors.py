@@ -1,31 +1,55 @@
 import os
+import sys
 import json
-import chromadb
-from chromadb.utils import embedding_functions
 import uuid
 
-# --- CONFIGURATION ---
-DB_PATH = "./chroma_db"
-COLLECTION_NAME = "financial_knowledge"
-EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+from entity_extraction import (
+    date_from_filename, entity_metadata, match_entities, normalize_entities, parse_ymd,
+)
+from env_flags import env_flag
+import profiling
+import vector_store
+from vector_store import add_units
+from work_claims import file_version, get_claims
 
-# Global Client (Initialize once)
-client = chromadb.PersistentClient(path=DB_PATH)
-ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL_NAME)
-collection = client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=ef)
+# NOTE: The Chroma client and the embedding model are created lazily by
+# vector_store on the first ingest, so importing this module is cheap.
+
+# Fold near-duplicate units into one canonical record (see near_dedup.py).
+# Override with NEAR_DEDUP=0.
+NEAR_DEDUP = True
+
+def near_dedup_enabled():
+    return env_flag("NEAR_DEDUP", NEAR_DEDUP)
 
 def ingest_single_file(file_path, source_type):
     """
     Process ONE specific JSON file and add it to the DB.
+    Claims the file first (see work_claims.py) so that when several watchers
+    share data/, each version of a file is ingested exactly once.
+    """
+    claim_key = f"ingest:{source_type}/{os.path.basename(file_path)}"
+    with get_claims().lease(claim_key, path=os.path.abspath(file_path),
+                            version=file_version(file_path), remember=True) as lease:
+        if not lease:
+            print(f"🔒 Skipping ingest of {os.path.basename(file_path)} (claimed or already ingested)")
+            return
+        if not _ingest_claimed_file(file_path, source_type):
+            lease.outcome = "failed"
+
+def _ingest_claimed_file(file_path, source_type):
+    """
+    Returns False if the file could not be read (so the claim is released).
     """
     print(f"⚡ Ingesting file: {file_path}")
     
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
-            json_content = json.load(f)
+            with profiling.section("json.parse"):
+                json_content = json.load(f)
     except Exception as e:
         print(f"❌ Error reading JSON: {e}")
-        return
+        return False
 
     documents = []
     metadatas = []
@@ -34,9 +58,32 @@ def ingest_single_file(file_path, source_type):
     items = json_content.get("data", [])
     if not isinstance(items, list):
         print(f"⚠️ Warning: 'data' is not a list in {file_path}")
-        return
+        return False
 
     filename = os.path.basename(file_path)
+    file_meta = json_content.get("meta", {}) if isinstance(json_content.get("meta"), dict) else {}
+
+    # File-level context: publication date, plus the company the whole report
+    # (or video title) is about even when a unit doesn't name it again.
+    published = parse_ymd(file_meta.get("published")) or date_from_filename(filename)
+    subject = file_meta.get("title", "")
+    if not subject and source_type == "institutional":
+        subject = filename.replace("institutional_", "").replace("_", " ")
+    file_tickers = set(match_entities(subject))
+    origin = filename.replace(".json", "")
+
+    # Near-duplicate folding. The loop only reads the shared index; what to
+    # add/fold is collected here and written in one short transaction after
+    # the Chroma upsert succeeded, so workers never wait on each other's embedding.
+    dedup_index = None
+    if near_dedup_enabled():
+        from near_dedup import (
+            SIMILARITY_THRESHOLD, estimated_similarity, get_index, minhash_signature, sources_metadata,
+        )
+        dedup_index = get_index()
+    new_canonical = {}   # unit id -> [collection, signature, in-file duplicates]
+    folds = []           # canonical ids from earlier files that this file repeats
+    folded_count = 0
 
     for item in items:
         text_content = item.get("text", "")
@@ -45,26 +92,70 @@ def ingest_single_file(file_path, source_type):
         if not text_content or len(text_content) < 5:
             continue
 
-        documents.append(text_content)
-        metadatas.append({
+        # Unit-level entities: LLM extraction (if present) + local matcher
+        tickers = file_tickers | set(normalize_entities(item.get("entities"))) | set(match_entities(text_content))
+
+        metadata = {
             "source_type": source_type,
             "filename": filename,
             "category": category_type,
-            "origin_source": filename.replace(".json", "")
-        })
-        ids.append(f"{filename}-{uuid.uuid4()}")
+            "origin_source": origin
+        }
+        metadata.update(entity_metadata(sorted(tickers), published))
+        unit_id = f"{filename}-{uuid.uuid4()}"
+
+        if dedup_index:
+            signature = minhash_signature(text_content)
+            canonical_id = dedup_index.find(source_type, signature)
+            if canonical_id is None:
+                # Duplicates within this file: same origin, so only the count changes
+                for uid, pending in new_canonical.items():
+                    if estimated_similarity(signature, pending[1]) >= SIMILARITY_THRESHOLD:
+                        canonical_id = uid
+                        pending[2] += 1
+                        break
+            elif canonical_id not in folds:
+                folds.append(canonical_id)
+            if canonical_id:
+                folded_count += 1
+                continue
+            new_canonical[unit_id] = [vector_store.collection_for(metadata), signature, 0]
+            metadata.update(sources_metadata([origin]))
+
+        documents.append(text_content)
+        metadatas.append(metadata)
+        ids.append(unit_id)
 
     if documents:
-        collection.upsert(documents=documents, metadatas=metadatas, ids=ids)
-        print(f"✅ Successfully added {len(documents)} records from {filename}")
+        # Routed to the shared collection or the right partitions
+        add_units(documents, metadatas, ids)
+
+    if dedup_index and (new_canonical or folds):
+        with dedup_index.transaction():
+            for unit_id, (collection_name, signature, dups) in new_canonical.items():
+                dedup_index.add(unit_id, source_type, collection_name, signature, origin, dup_count=dups)
+            by_collection = {}
+            for canonical_id in folds:
+                collection_name, sources = dedup_index.fold(canonical_id, origin)
+                by_collection.setdefault(collection_name, {})[canonical_id] = sources_metadata(sources)
+        # Record the extra sources on canonical units from earlier files. If this
+        # fails the file is retried: its units then fold into themselves and the
+        # update is repeated.
+        for collection_name, patches in by_collection.items():
+            vector_store.update_metadata(collection_name, patches)
+
+    if documents or folded_count:
+        dup_note = f" (folded {folded_count} near-duplicates)" if folded_count else ""
+        print(f"✅ Successfully added {len(documents)} records from {filename}{dup_note}")
     else:
         print(f"⚠️ No valid data found in {filename}")
+    return True
 
 # Keeping the original batch logic for manual runs
 def process_all_folders():
     DATA_DIRS = {
-        "retail": "./data_processed/retail",
-        "institutional": "./data_processed/institutional"
+        "retail": "./data/retail/processed",
+        "institutional": "./data/institutional/processed"
     }
     for source, directory in DATA_DIRS.items():
         if os.path.exists(directory):
@@ -72,5 +163,39 @@ def process_all_folders():
                 if f.endswith(".json"):
                     ingest_single_file(os.path.join(directory, f), source)
 
+    if near_dedup_enabled():
+        from near_dedup import get_index, print_stats
+        print("\n📊 Near-duplicate folding (index-size reduction):")
+        print_stats(get_index().stats())
+
+def backfill_entity_metadata(batch_size=500):
+    """
+    Adds ticker/date metadata to units ingested before entity extraction
+    existed. Only metadata is updated; nothing is re-embedded.
+    """
+    for name in vector_store.layout_collections():
+        collection = vector_store.get_collection(name, create=False)
+        total = collection.count()
+        updated = 0
+        for offset in range(0, total, batch_size):
+            page = collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+            patches = {}
+            for uid, doc, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+                filename = meta.get("filename", "")
+                tickers = set(match_entities(doc))
+                if meta.get("source_type") == "institutional":
+                    tickers |= set(match_entities(filename.replace("institutional_", "").replace("_", " ")))
+                extra = entity_metadata(sorted(tickers), date_from_filename(filename))
+                if extra:
+                    patches[uid] = extra
+            # Through vector_store so the NumPy index and any shadow generation get the tags too
+            vector_store.update_metadata(name, patches)
+            updated += len(patches)
+        print(f"✅ {name}: tagged {updated}/{total} records")
+
 if __name__ == "__main__":
-    process_all_folders()
\ No newline at end of file
+    profiling.start("ingest_vectors")  # PROFILE=1 or --profile
+    if "--backfill-entities" in sys.argv:
+        backfill_entity_metadata()
+    else:
+        process_all_folders()
\ No newline at end of file
@@ -1,6 +1,8 @@
 import os
 import pdfplumber
 
+import profiling
+
 # Configuration
 # Put your downloaded PDFs in this folder
 SOURCE_PDF_DIR = "data/institutional/raw" 
@@ -45,7 +47,8 @@ def batch_convert_local_pdfs():
             full_text = ""
             with pdfplumber.open(pdf_path) as pdf:
                 for page in pdf.pages:
-                    text = page.extract_text()
+                    with profiling.section("pdfplumber.extract_text"):
+                        text = page.extract_text()
                     if text:
                         full_text += text + "\n"
             
@@ -61,4 +64,5 @@ def batch_convert_local_pdfs():
     print("\n🎉 Batch extraction complete!")
 
 if __name__ == "__main__":
+    profiling.start("institutional_scraper")  # PROFILE=1 or --profile
     batch_convert_local_pdfs()
\ No newline at end of file
@@ -0,0 +1,316 @@
+"""
+Zero-downtime re-embedding: move the vector store to a new embedding model
+while the app keeps serving queries.
+
+  1. start   -> registers a "shadow" generation (new collection name + model).
+                From now on ingest writes every new unit to both generations.
+  2. run     -> copies every unit from the active generation into the shadow,
+                re-embedding it with the new model. Units are copied in sorted
+                id order and the last copied id is checkpointed after every
+                batch, so deletes/upserts in the source during a throttled run
+                can't make it skip anything. Throttled (--rate) so live queries
+                keep their latency; idempotent (same ids, upserts).
+  3. switch  -> once every source id exists in the shadow (checked id by id,
+                counts can be padded by dual-written ingests), atomically swaps active and
+                shadow in chroma_db/embedding_state.json. Readers pick it up on
+                their next query. The old generation stays the shadow and keeps
+                receiving writes, so `switch` again is an instant rollback.
+  4. finish  -> stop dual-writing (drops the shadow from the state file;
+                --delete also removes its collections).
+
+Units deleted from the active generation during a migration (e.g. near_dedup
+compaction) are not deleted from the shadow: don't compact mid-migration.
+
+Usage:
+    python migrate_embeddings.py start --model paraphrase-multilingual-MiniLM-L12-v2
+    python migrate_embeddings.py run [--batch-size 64] [--rate 40] [--threads 2]
+    python migrate_embeddings.py status
+    python migrate_embeddings.py switch [--force]
+    python migrate_embeddings.py finish [--delete]
+"""
+import argparse
+import json
+import os
+import time
+
+import vector_store
+
+PROGRESS_FILENAME = "embedding_migration.json"
+DEFAULT_RATE = 40        # units re-embedded per second (0 = unthrottled)
+DEFAULT_BATCH_SIZE = 64
+
+
+def _progress_path():
+    return os.path.join(vector_store.DB_PATH, PROGRESS_FILENAME)
+
+
+def load_progress(shadow_collection):
+    try:
+        with open(_progress_path(), "r", encoding="utf-8") as f:
+            return json.load(f).get(shadow_collection, {})
+    except FileNotFoundError:
+        return {}
+
+
+def save_progress(shadow_collection, progress):
+    try:
+        with open(_progress_path(), "r", encoding="utf-8") as f:
+            everything = json.load(f)
+    except FileNotFoundError:
+        everything = {}
+    everything[shadow_collection] = progress
+    tmp = _progress_path() + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(everything, f, indent=4)
+    os.replace(tmp, _progress_path())
+
+
+def shadow_name_for(model_name):
+    # Chroma caps names at 63 chars and partitions append up to 41 more
+    return f"kb-{vector_store._slug(model_name, max_len=18)}"
+
+
+def start(model_name, collection=None):
+    state = dict(vector_store.read_state())
+    if state.get("shadow"):
+        print(f"❌ A migration to {state['shadow']['model']} is already registered (finish it first).")
+        return
+    if model_name == state["model"]:
+        print(f"❌ {model_name} is already the active model.")
+        return
+
+    shadow = {"collection": collection or shadow_name_for(model_name), "model": model_name, "complete": False}
+    # Load the model once here so a typo fails now, not inside every ingest
+    vector_store.create_embedding_function(model_name=model_name)(["warm up"])
+    state["shadow"] = shadow
+    save_progress(shadow["collection"], {})  # Fresh start, even if this name was used before
+    vector_store.write_state(state)
+    print(f"🌗 Shadow generation '{shadow['collection']}' ({model_name}) registered.")
+    print("   Ingest now dual-writes. Next: python migrate_embeddings.py run")
+
+
+def _limit_threads(threads):
+    """
+    Leave CPU for the live query path: cap the threads the embedding model uses.
+    """
+    if not threads:
+        return
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def run(batch_size=DEFAULT_BATCH_SIZE, rate=DEFAULT_RATE, threads=0):
+    shadow = vector_store.shadow_generation()
+    if not shadow:
+        print("❌ No migration registered. Run: python migrate_embeddings.py start --model <name>")
+        return
+    if shadow.get("complete"):
+        print(f"✅ '{shadow['collection']}' is already complete.")
+        return
+
+    _limit_threads(threads)
+    active = vector_store.active_generation()
+    progress = load_progress(shadow["collection"])
+    copied_total, started = 0, time.perf_counter()
+
+    for name in vector_store.layout_collections(active["collection"]):
+        source = vector_store.get_collection(name, create=False)
+        target_name = vector_store.rebase(name, shadow["collection"])
+        target = vector_store.get_collection(target_name, metadata=source.metadata)
+        # Resume after the last copied id, not at a page offset: offsets shift
+        # when units are deleted (near_dedup) or re-upserted mid-run
+        last_id = progress.get(name)
+        if not isinstance(last_id, str):
+            last_id = None  # Offset checkpoint from an older version: start over (upserts are idempotent)
+        ids = [uid for uid in all_ids(source) if last_id is None or uid > last_id]
+        print(f"📦 {name} -> {target_name}: {len(ids)} units left"
+              + (f" (resuming after {last_id})" if last_id else ""))
+
+        def checkpoint(batch_ids, name=name):
+            progress[name] = batch_ids[-1]
+            save_progress(shadow["collection"], progress)
+
+        copied_total += _copy(source, target, ids, batch_size, rate, checkpoint)
+
+    # Anything still missing (e.g. an id below the checkpoint that a concurrent
+    # writer re-created) is copied by id before the shadow counts as complete
+    for name, ids in missing_ids(active, shadow).items():
+        if not ids:
+            continue
+        source = vector_store.get_collection(name, create=False)
+        target_name = vector_store.rebase(name, shadow["collection"])
+        target = vector_store.get_collection(target_name, metadata=source.metadata)
+        print(f"🩹 {name}: copying {len(ids)} missing units")
+        copied_total += _copy(source, target, ids, batch_size, rate)
+
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ Re-embedded {copied_total} units in {elapsed:.0f}s.")
+    if _shadow_is_complete(active, shadow):
+        state = dict(vector_store.read_state())
+        state["shadow"] = {**shadow, "complete": True}
+        vector_store.write_state(state)
+        print("   Shadow is complete. Next: python migrate_embeddings.py switch")
+
+
+def _copy(source, target, ids, batch_size, rate, checkpoint=None):
+    """
+    Re-embeds the given source ids into target, throttled to `rate` units/s.
+    Ids deleted from the source meanwhile are simply skipped.
+    """
+    copied = 0
+    for start in range(0, len(ids), batch_size):
+        batch_start = time.perf_counter()
+        batch_ids = ids[start:start + batch_size]
+        page = source.get(ids=batch_ids, include=["documents", "metadatas"])
+        if page["ids"]:
+            # Documents only: the target collection embeds them with the new model
+            target.upsert(ids=page["ids"], documents=page["documents"], metadatas=page["metadatas"])
+        copied += len(page["ids"])
+        if checkpoint:
+            checkpoint(batch_ids)
+        print(f"   ➡️  {start + len(batch_ids)}/{len(ids)}")
+
+        if rate:
+            # Sleep off whatever the batch finished early
+            time.sleep(max(0.0, len(page["ids"]) / rate - (time.perf_counter() - batch_start)))
+    return copied
+
+
+def all_ids(collection):
+    """
+    Every id in a collection, sorted (one ids-only read, no documents).
+    """
+    return sorted(collection.get(include=[])["ids"])
+
+
+def missing_ids(active, shadow, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    {active collection: [ids not in its shadow counterpart]}. Only ids count:
+    a shadow can have as many units as the source while missing some.
+    """
+    client = vector_store.get_client()
+    existing = {getattr(c, "name", c) for c in client.list_collections()}
+    missing = {}
+    for name in vector_store.layout_collections(active["collection"]):
+        ids = all_ids(client.get_collection(name))
+        target_name = vector_store.rebase(name, shadow["collection"])
+        if target_name not in existing:
+            missing[name] = ids
+            continue
+        target = client.get_collection(target_name)
+        absent = []
+        for start in range(0, len(ids), batch_size):
+            page_ids = ids[start:start + batch_size]
+            found = set(target.get(ids=page_ids, include=[])["ids"])
+            absent.extend(uid for uid in page_ids if uid not in found)
+        missing[name] = absent
+    return missing
+
+
+def _pairs(active, shadow):
+    """
+    (active collection, shadow collection, active count, shadow count).
+    """
+    client = vector_store.get_client()
+    existing = {getattr(c, "name", c) for c in client.list_collections()}
+    rows = []
+    for name in vector_store.layout_collections(active["collection"]):
+        target = vector_store.rebase(name, shadow["collection"])
+        target_count = client.get_collection(target).count() if target in existing else 0
+        rows.append((name, target, client.get_collection(name).count(), target_count))
+    return rows
+
+
+def _shadow_is_complete(active, shadow):
+    missing = missing_ids(active, shadow)
+    for name, ids in missing.items():
+        if ids:
+            print(f"   ⚠️ {name}: {len(ids)} units missing from the shadow (e.g. {ids[0]})")
+    return not any(missing.values())
+
+
+def status():
+    active = vector_store.active_generation()
+    shadow = vector_store.shadow_generation()
+    print(f"🟢 Active: {active['collection']} ({active['model']})")
+    if not shadow:
+        print("   No shadow generation (no migration running).")
+        return
+    print(f"🌗 Shadow: {shadow['collection']} ({shadow['model']}), complete={shadow.get('complete', False)}")
+    for name, target, count, target_count in _pairs(active, shadow):
+        pct = target_count / count if count else 1.0
+        print(f"   {name:<48} {count:>7}  ->  {target_count:>7}  ({pct:.0%})")
+
+
+def switch(force=False):
+    state = dict(vector_store.read_state())
+    shadow = state.get("shadow")
+    if not shadow:
+        print("❌ Nothing to switch to.")
+        return
+    active = {"collection": state["collection"], "model": state["model"]}
+    if not force and not _shadow_is_complete(active, shadow):
+        print("❌ Shadow is missing units. Re-run `run` (it resumes by id) or use --force.")
+        return
+
+    # Swap: the old generation becomes the shadow and keeps receiving writes
+    new_state = {
+        "collection": shadow["collection"],
+        "model": shadow["model"],
+        "shadow": {**active, "complete": True},
+        "switched_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    vector_store.write_state(new_state)
+    print(f"🔀 Readers now use {shadow['collection']} ({shadow['model']}).")
+    print(f"   {active['collection']} stays in sync for rollback (run `switch` again),")
+    print("   or stop dual-writing with: python migrate_embeddings.py finish")
+
+
+def finish(delete=False):
+    state = dict(vector_store.read_state())
+    shadow = state.pop("shadow", None)
+    if not shadow:
+        print("❌ No shadow generation registered.")
+        return
+    vector_store.write_state(state)
+    print(f"🏁 Stopped dual-writing to {shadow['collection']}.")
+
+    if delete:
+        client = vector_store.get_client()
+        for name in [getattr(c, "name", c) for c in client.list_collections()]:
+            if name.split(vector_store.PARTITION_SEPARATOR)[0] == shadow["collection"]:
+                client.delete_collection(name)
+                vector_store._collections.pop(name, None)
+                print(f"   🗑️ Deleted {name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed the vector store with a new model, without downtime.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_start = sub.add_parser("start")
+    p_start.add_argument("--model", required=True, help="sentence-transformers model name")
+    p_start.add_argument("--collection", help="Shadow collection base name (default: derived from the model)")
+    p_run = sub.add_parser("run")
+    p_run.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    p_run.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Max units/s (0 = unthrottled)")
+    p_run.add_argument("--threads", type=int, default=0, help="Cap embedding CPU threads (0 = no cap)")
+    sub.add_parser("status")
+    p_switch = sub.add_parser("switch")
+    p_switch.add_argument("--force", action="store_true")
+    p_finish = sub.add_parser("finish")
+    p_finish.add_argument("--delete", action="store_true", help="Also delete the shadow collections")
+    args = parser.parse_args()
+
+    if args.command == "start":
+        start(args.model, args.collection)
+    elif args.command == "run":
+        run(args.batch_size, args.rate, args.threads)
+    elif args.command == "status":
+        status()
+    elif args.command == "switch":
+        switch(args.force)
+    else:
+        finish(args.delete)
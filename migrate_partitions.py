@@ -0,0 +1,123 @@
+"""
+Moves the shared `financial_knowledge` collection into the partitioned layout
+(one collection per source type, institutional split per year or ticker).
+
+Stored embeddings are copied as-is, so nothing is re-embedded. Upserts keep
+the original ids, so the migration is safe to re-run if it gets interrupted.
+
+Usage:
+    python migrate_partitions.py migrate [--dry-run] [--batch-size 500]
+    python migrate_partitions.py status
+    python migrate_partitions.py tune          # re-apply PARTITION_HNSW search settings
+
+Then set COLLECTION_LAYOUT=partitioned in .env to switch readers and ingest.
+The shared collection is left untouched (delete it yourself once happy).
+"""
+import argparse
+
+import vector_store
+from vector_store import SOURCE_TYPES
+
+
+def migrate(batch_size=500, dry_run=False):
+    # The shared collection of whichever embedding generation is active
+    source_name = vector_store.active_generation()["collection"]
+    source = vector_store.get_collection(source_name, create=False)
+    total = source.count()
+    print(f"📋 Source collection '{source_name}': {total} records")
+
+    counts = {}
+    offset = 0
+    while offset < total:
+        page = source.get(
+            limit=batch_size,
+            offset=offset,
+            include=["documents", "metadatas", "embeddings"],
+        )
+        if not page["ids"]:
+            break
+
+        # Group this page by target partition
+        groups = {}
+        for uid, doc, meta, emb in zip(page["ids"], page["documents"], page["metadatas"], page["embeddings"]):
+            name = vector_store.partition_name(meta)
+            group = groups.setdefault(name, {"ids": [], "documents": [], "metadatas": [], "embeddings": []})
+            group["ids"].append(uid)
+            group["documents"].append(doc)
+            group["metadatas"].append(meta)
+            group["embeddings"].append(emb)
+
+        for name, group in groups.items():
+            counts[name] = counts.get(name, 0) + len(group["ids"])
+            if dry_run:
+                continue
+            source_type = group["metadatas"][0].get("source_type", "unknown")
+            target = vector_store.get_collection(name, metadata=vector_store.partition_settings(source_type))
+            target.upsert(**group)
+
+        offset += len(page["ids"])
+        print(f"   ➡️  {offset}/{total} copied")
+
+    print("\n" + ("🧪 DRY RUN - nothing written" if dry_run else "✅ Migration complete"))
+    for name in sorted(counts):
+        print(f"   {name}: {counts[name]}")
+    if not dry_run:
+        print("\nSet COLLECTION_LAYOUT=partitioned to start using the partitions.")
+
+
+def status():
+    client = vector_store.get_client()
+    for source_type in SOURCE_TYPES:
+        print(f"\n📂 {source_type}")
+        partitions = vector_store.list_partitions(source_type, refresh=True)
+        if not partitions:
+            print("   (no partitions)")
+        for name in partitions:
+            collection = client.get_collection(name)
+            print(f"   {name}: {collection.count()} records, {collection.metadata}")
+
+
+def tune():
+    """
+    Pushes the current PARTITION_HNSW values to existing partitions.
+    Only search-time settings can change after creation; M / construction_ef
+    need a rebuild (delete the partition and re-run migrate).
+    """
+    client = vector_store.get_client()
+    for source_type in SOURCE_TYPES:
+        settings = vector_store.partition_settings(source_type)
+        search_settings = {k: v for k, v in settings.items() if k == "hnsw:search_ef"}
+        if not search_settings:
+            continue
+        for name in vector_store.list_partitions(source_type, refresh=True):
+            collection = client.get_collection(name)
+            try:
+                try:
+                    # chromadb >= 1.0 keeps HNSW settings in the collection configuration
+                    collection.modify(configuration={"hnsw": {"ef_search": search_settings["hnsw:search_ef"]}})
+                except (TypeError, ValueError):
+                    # Older releases read them from metadata (and refuse to change the space)
+                    metadata = {k: v for k, v in (collection.metadata or {}).items() if k != "hnsw:space"}
+                    metadata.update(search_settings)
+                    collection.modify(metadata=metadata)
+                print(f"✅ {name}: {search_settings}")
+            except Exception as e:
+                print(f"❌ {name}: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared -> partitioned collection migration.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_migrate = sub.add_parser("migrate")
+    p_migrate.add_argument("--batch-size", type=int, default=500)
+    p_migrate.add_argument("--dry-run", action="store_true")
+    sub.add_parser("status")
+    sub.add_parser("tune")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate(batch_size=args.batch_size, dry_run=args.dry_run)
+    elif args.command == "status":
+        status()
+    else:
+        tune()
@@ -0,0 +1,364 @@
+"""
+Near-duplicate detection for extracted units (MinHash + LSH).
+
+The same principle ("buy the dip", "dividend snowball") shows up in dozens of
+videos, and the same facts repeat across broker reports. Instead of storing
+each copy as its own vector, ingest keeps ONE canonical unit and records every
+contributing source in its metadata (`sources`, `source_count`).
+
+Text is shingled so it works on mixed Chinese/English: every CJK character is
+a token, every Latin word/number is a token, and shingles are 3-token windows.
+Duplicates are only folded within the same source type (a retail opinion and
+an institutional fact are different perspectives even if worded alike).
+
+The LSH index is persisted in SQLite next to the vector store so new files are
+checked against everything ingested before.
+
+Usage:
+    python near_dedup.py stats
+    python near_dedup.py compact [--apply]   # fold duplicates already in Chroma
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import unicodedata
+from contextlib import contextmanager
+
+import numpy as np
+
+from vector_store import DB_PATH
+
+# --- CONFIGURATION ---
+INDEX_PATH = os.path.join(DB_PATH, "near_dup_index.sqlite")
+NUM_PERM = 128
+BANDS = 16                # 16 bands x 8 rows -> candidates from ~0.7 Jaccard
+SIMILARITY_THRESHOLD = 0.8
+SHINGLE_SIZE = 3
+MAX_SOURCES_IN_METADATA = 50
+BUSY_TIMEOUT = 60         # Seconds to wait for another worker's write transaction
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, _MERSENNE_PRIME, size=NUM_PERM).astype(np.int64)
+_PERM_B = _rng.randint(0, _MERSENNE_PRIME, size=NUM_PERM).astype(np.int64)
+_TOKEN_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]|[a-z0-9]+")
+
+
+def tokenize(text):
+    normalized = unicodedata.normalize("NFKC", text or "").lower()
+    return _TOKEN_PATTERN.findall(normalized)
+
+
+def shingles(text, k=SHINGLE_SIZE):
+    tokens = tokenize(text)
+    if len(tokens) <= k:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + k]) for i in range(len(tokens) - k + 1)}
+
+
+def minhash_signature(text):
+    """
+    NUM_PERM-long MinHash signature (int64 array).
+    """
+    grams = shingles(text)
+    if not grams:
+        return np.full(NUM_PERM, _MERSENNE_PRIME, dtype=np.int64)
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest(), "little") for g in grams],
+        dtype=np.int64,
+    ) % _MERSENNE_PRIME
+    # (a * h + b) mod p for every permutation at once -> min over shingles
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME
+    return permuted.min(axis=1)
+
+
+def estimated_similarity(sig_a, sig_b):
+    return float(np.mean(sig_a == sig_b))
+
+
+def _band_keys(source_type, signature):
+    rows = NUM_PERM // BANDS
+    keys = []
+    for band in range(BANDS):
+        chunk = signature[band * rows:(band + 1) * rows].tobytes()
+        keys.append(f"{source_type}:{band}:{hashlib.blake2b(chunk, digest_size=8).hexdigest()}")
+    return keys
+
+
+class NearDuplicateIndex:
+    """
+    Persistent LSH index of canonical units, shared by every ingest worker.
+    add() and fold() must run inside transaction() (or begin() ... commit()):
+    ingest calls them only after its Chroma upsert succeeded, so the write
+    lock is held for milliseconds and the index never points at vectors that
+    don't exist.
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Autocommit mode: writes use explicit BEGIN IMMEDIATE transactions
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS canonical (
+                id TEXT PRIMARY KEY,
+                source_type TEXT NOT NULL,
+                collection TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                sources TEXT NOT NULL,
+                dup_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS bands (
+                band_key TEXT NOT NULL,
+                id TEXT NOT NULL,
+                UNIQUE (band_key, id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_bands_key ON bands(band_key);
+        """)
+        # Indexes created before the UNIQUE constraint: drop repeated band rows
+        # (re-added units) once, then enforce it with a unique index
+        if not self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND tbl_name = 'bands' "
+            "AND (name = 'idx_bands_unique' OR name LIKE 'sqlite_autoindex_bands_%')"
+        ).fetchone():
+            with self.transaction():
+                self._conn.execute(
+                    "DELETE FROM bands WHERE rowid NOT IN (SELECT MIN(rowid) FROM bands GROUP BY band_key, id)"
+                )
+                self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_bands_unique ON bands(band_key, id)")
+
+    def find(self, source_type, signature):
+        """
+        Canonical id of a near-duplicate already in the index, or None.
+        """
+        keys = _band_keys(source_type, signature)
+        with self._lock:
+            placeholders = ",".join("?" * len(keys))
+            candidates = self._conn.execute(
+                f"SELECT DISTINCT c.id, c.signature FROM bands b JOIN canonical c ON c.id = b.id "
+                f"WHERE b.band_key IN ({placeholders})", keys
+            ).fetchall()
+
+        best_id, best_sim = None, SIMILARITY_THRESHOLD
+        for uid, blob in candidates:
+            sim = estimated_similarity(signature, np.frombuffer(blob, dtype=np.int64))
+            if sim >= best_sim:
+                best_id, best_sim = uid, sim
+        return best_id
+
+    def add(self, uid, source_type, collection, signature, source, dup_count=0):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO canonical (id, source_type, collection, signature, sources, dup_count) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (uid, source_type, collection, signature.astype(np.int64).tobytes(), json.dumps([source]),
+                 dup_count),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO bands (band_key, id) VALUES (?, ?)",
+                [(key, uid) for key in _band_keys(source_type, signature)],
+            )
+
+    def fold(self, canonical_id, source):
+        """
+        Records one more copy of canonical_id coming from `source`.
+        Returns (collection, sources list) for the metadata update.
+        """
+        with self._lock:
+            collection, sources_json = self._conn.execute(
+                "SELECT collection, sources FROM canonical WHERE id = ?", (canonical_id,)
+            ).fetchone()
+            sources = json.loads(sources_json)
+            if source not in sources:
+                sources.append(source)
+            self._conn.execute(
+                "UPDATE canonical SET sources = ?, dup_count = dup_count + 1 WHERE id = ?",
+                (json.dumps(sources), canonical_id),
+            )
+            return collection, sources
+
+    def begin(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        with self._lock:
+            self._conn.execute("COMMIT")
+
+    def rollback(self):
+        with self._lock:
+            self._conn.execute("ROLLBACK")
+
+    @contextmanager
+    def transaction(self):
+        """
+        with index.transaction(): index.add(...); index.fold(...)
+        Commits on success, rolls back on any exception.
+        """
+        with self._lock:
+            self.begin()
+            try:
+                yield self
+            except BaseException:
+                self.rollback()
+                raise
+            self.commit()
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source_type, COUNT(*), COALESCE(SUM(dup_count), 0) FROM canonical GROUP BY source_type"
+            ).fetchall()
+        return {st: {"stored": stored, "seen": stored + dups} for st, stored, dups in rows}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = NearDuplicateIndex()
+    return _index
+
+
+def sources_metadata(sources):
+    """
+    Chroma metadata can't hold lists: comma-joined (capped) + a count.
+    """
+    return {
+        "sources": ",".join(sources[:MAX_SOURCES_IN_METADATA]),
+        "source_count": len(sources),
+    }
+
+
+def print_stats(stats):
+    total_seen = sum(s["seen"] for s in stats.values())
+    total_stored = sum(s["stored"] for s in stats.values())
+    for source_type, s in sorted(stats.items()):
+        saved = 1 - s["stored"] / s["seen"] if s["seen"] else 0
+        print(f"   {source_type:<14} seen {s['seen']:>6}  stored {s['stored']:>6}  (-{saved:.1%})")
+    if total_seen:
+        print(f"   {'TOTAL':<14} seen {total_seen:>6}  stored {total_stored:>6}  "
+              f"(-{1 - total_stored / total_seen:.1%} vectors)")
+
+
+class _PendingCanonicals:
+    """
+    Canonical units found by compact_existing() that aren't in the index yet:
+    the rest of the page (or the whole dry run) is checked against them too.
+    """
+
+    def __init__(self):
+        self.bands = {}
+        self.signatures = {}
+
+    def add(self, uid, source_type, signature):
+        self.signatures[uid] = signature
+        for key in _band_keys(source_type, signature):
+            self.bands.setdefault(key, []).append(uid)
+
+    def find(self, source_type, signature):
+        candidates = {uid for key in _band_keys(source_type, signature) for uid in self.bands.get(key, ())}
+        best_id, best_sim = None, SIMILARITY_THRESHOLD
+        for uid in candidates:
+            sim = estimated_similarity(signature, self.signatures[uid])
+            if sim >= best_sim:
+                best_id, best_sim = uid, sim
+        return best_id
+
+    def clear(self):
+        self.bands.clear()
+        self.signatures.clear()
+
+
+def compact_existing(apply=False, batch_size=500):
+    """
+    Folds near-duplicates that are already in Chroma (ingested before this
+    stage existed) and rebuilds the LSH index from what is kept.
+
+    The scan only reads the index. Like ingest, each page's adds/folds are
+    written in one short transaction after that page's Chroma deletes
+    succeeded, so ingest workers are never blocked for the whole scan. A dry
+    run writes nothing.
+    """
+    import vector_store
+
+    index = get_index()
+    pending = _PendingCanonicals()
+    projected = {}     # source_type -> [new canonical units, folded units] (dry run)
+
+    for name in vector_store.layout_collections():
+        collection = vector_store.get_collection(name, create=False)
+        # Page by id: deleting duplicates would shift offset-based pages
+        all_ids = sorted(collection.get(include=[])["ids"])
+        removed, updated = 0, set()
+
+        for start in range(0, len(all_ids), batch_size):
+            page = collection.get(ids=all_ids[start:start + batch_size], include=["documents", "metadatas"])
+            new_canonical, folds, to_delete = [], [], []
+            for uid, doc, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+                source_type = meta.get("source_type", "unknown")
+                origin = meta.get("origin_source", meta.get("filename", ""))
+                signature = minhash_signature(doc)
+                dup = index.find(source_type, signature) or pending.find(source_type, signature)
+                if dup == uid:
+                    continue
+                counts = projected.setdefault(source_type, [0, 0])
+                if dup:
+                    folds.append((dup, origin))
+                    to_delete.append(uid)
+                    counts[1] += 1
+                else:
+                    new_canonical.append((uid, source_type, signature, origin))
+                    pending.add(uid, source_type, signature)
+                    counts[0] += 1
+
+            if not apply:
+                removed += len(to_delete)
+                continue
+
+            if to_delete:
+                vector_store.delete_units(name, to_delete)
+            by_collection = {}
+            with index.transaction():
+                for uid, source_type, signature, origin in new_canonical:
+                    index.add(uid, source_type, name, signature, origin)
+                for canonical_id, origin in folds:
+                    collection_name, sources = index.fold(canonical_id, origin)
+                    by_collection.setdefault(collection_name, {})[canonical_id] = sources_metadata(sources)
+            pending.clear()
+            for collection_name, patches in by_collection.items():
+                vector_store.update_metadata(collection_name, patches)
+            removed += len(to_delete)
+            updated.update(uid for patches in by_collection.values() for uid in patches)
+
+        print(f"📦 {name}: {len(all_ids)} records, {removed} near-duplicates")
+        if apply:
+            print(f"   ✅ Removed {removed}, updated {len(updated)} canonical records")
+
+    stats = index.stats()
+    if apply:
+        print("\n📊 Index after compaction:")
+    else:
+        print("\n🧪 DRY RUN - nothing changed (use --apply). Projected:")
+        for source_type, (added, folded) in projected.items():
+            s = stats.setdefault(source_type, {"stored": 0, "seen": 0})
+            s["stored"] += added
+            s["seen"] += added + folded
+    print_stats(stats)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "compact":
+        compact_existing(apply="--apply" in sys.argv)
+    else:
+        print("📊 Near-duplicate index:")
+        print_stats(get_index().stats())
@@ -0,0 +1,387 @@
+"""
+Exact (brute-force) vector search over a memory-mapped NumPy matrix.
+
+At our size (tens of thousands of short units) one matrix product over every
+vector is exact and cheaper than Chroma's SQLite + HNSW path, especially with
+metadata filters. Select it with RETRIEVAL_BACKEND=numpy (see vector_store).
+
+On disk, per embedding generation (chroma_db/numpy_index/<collection>/):
+  meta.json      -> dim, model, build id
+  vectors.f32    -> L2-normalised float32 rows, appended in place (np.memmap'd)
+  records.jsonl  -> one line per row {"row", "id", "document", "metadata"},
+                    plus {"id", "patch"} / {"id", "delete"} lines
+
+Ingest appends to both files (vector_store.add_units / update_metadata /
+delete_units), so the index is kept up to date incrementally once built.
+Readers only parse the new tail of records.jsonl when it grows; a rebuild
+changes the build id and triggers a full reload. Units ingested while a
+build is running are not in the new index: build with ingest paused.
+
+In memory, metadata is held as contiguous column arrays (source type code,
+alive flag, and any key a `where` clause touches, built on demand), so a filter
+is a boolean mask and a query is `scores = Q @ M.T` + argpartition.
+
+Usage:
+    python numpy_index.py build      # export the active generation from Chroma
+    python numpy_index.py stats
+"""
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+import numpy as np
+
+import vector_store
+
+INDEX_DIRNAME = "numpy_index"
+EXPORT_BATCH_SIZE = 1000
+
+try:
+    import fcntl
+except ImportError:  # Windows: single writer assumed
+    fcntl = None
+
+
+def index_dir(base):
+    return os.path.join(vector_store.DB_PATH, INDEX_DIRNAME, base)
+
+
+def index_exists(base):
+    return os.path.exists(os.path.join(index_dir(base), "meta.json"))
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.clip(norms, 1e-12, None)
+
+
+class _WriteLock:
+    """
+    Serialises appends from several ingest workers on one host (flock).
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, ".lock")
+
+    def __enter__(self):
+        self._f = open(self.path, "a")
+        if fcntl:
+            fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._f, fcntl.LOCK_UN)
+        self._f.close()
+
+
+# --- WRITING ---
+def append(base, ids, embeddings, documents, metadatas):
+    """
+    Adds (or replaces, same id) units. Embeddings are normalised here.
+    """
+    directory = index_dir(base)
+    vectors = _normalize(embeddings)
+    with _WriteLock(directory):
+        vectors_path = os.path.join(directory, "vectors.f32")
+        row_bytes = 4 * vectors.shape[1]
+        size = os.path.getsize(vectors_path)
+        first_row = size // row_bytes
+        # Vectors first: a record never points at a row that isn't written yet.
+        # An interrupted append can leave whole orphan rows (readers skip them,
+        # records carry their row) or half a row, which is cut off here.
+        with open(vectors_path, "r+b") as f:
+            f.truncate(first_row * row_bytes)
+            f.seek(first_row * row_bytes)
+            f.write(vectors.tobytes())
+            f.flush()
+        lines = [
+            json.dumps({"row": first_row + i, "id": uid, "document": doc, "metadata": meta}, ensure_ascii=False)
+            for i, (uid, doc, meta) in enumerate(zip(ids, documents, metadatas))
+        ]
+        _append_lines(directory, lines)
+
+
+def patch(base, patches):
+    lines = [json.dumps({"id": uid, "patch": p}, ensure_ascii=False) for uid, p in patches.items()]
+    with _WriteLock(index_dir(base)):
+        _append_lines(index_dir(base), lines)
+
+
+def delete(base, ids):
+    lines = [json.dumps({"id": uid, "delete": True}) for uid in ids]
+    with _WriteLock(index_dir(base)):
+        _append_lines(index_dir(base), lines)
+
+
+def _append_lines(directory, lines):
+    if not lines:
+        return
+    with open(os.path.join(directory, "records.jsonl"), "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+        f.flush()
+
+
+def build(base=None):
+    """
+    Full export of one generation from Chroma (all layouts' collections).
+    Built next to the live index and swapped in, so readers never see half of it.
+    """
+    generation = vector_store.active_generation()
+    base = base or generation["collection"]
+    target = index_dir(base)
+    building = target + ".building"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+
+    total, dim = 0, None
+    with open(os.path.join(building, "vectors.f32"), "wb") as vf, \
+            open(os.path.join(building, "records.jsonl"), "w", encoding="utf-8") as rf:
+        for name in vector_store.layout_collections(base):
+            collection = vector_store.get_collection(name, create=False)
+            count = collection.count()
+            for offset in range(0, count, EXPORT_BATCH_SIZE):
+                page = collection.get(limit=EXPORT_BATCH_SIZE, offset=offset,
+                                      include=["embeddings", "documents", "metadatas"])
+                if not len(page["ids"]):
+                    break
+                vectors = _normalize(page["embeddings"])
+                dim = vectors.shape[1]
+                vf.write(vectors.tobytes())
+                for uid, doc, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+                    rf.write(json.dumps({"row": total, "id": uid, "document": doc, "metadata": meta},
+                                        ensure_ascii=False) + "\n")
+                    total += 1
+            print(f"   📦 {name}: {count} units")
+
+    meta = {"collection": base, "model": generation["model"] if base == generation["collection"] else None,
+            "dim": dim, "build_id": f"{time.time():.6f}", "rows": total}
+    with open(os.path.join(building, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=4)
+
+    old = target + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(target):
+        os.replace(target, old)
+    os.replace(building, target)
+    shutil.rmtree(old, ignore_errors=True)
+    print(f"✅ NumPy index for '{base}': {total} vectors (dim {dim}) -> {target}")
+
+
+# --- READING ---
+class NumpyIndex:
+    """
+    Read side of one generation's index. Thread-safe; refresh() picks up
+    appends from ingest (or a rebuild) made by any process.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.directory = index_dir(base)
+        self._lock = threading.RLock()
+        self._build_id = None
+        self._reset()
+
+    def _reset(self):
+        self.dim = None
+        self._matrix = None
+        self._offset = 0            # bytes of records.jsonl already parsed
+        self._row_of = {}           # id -> current row
+        self._ids = []              # row -> id (None for orphan rows)
+        self._documents = []
+        self._metadatas = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._source_codes = np.zeros(0, dtype=np.int8)
+        self._columns = {}
+
+    def refresh(self):
+        with self._lock:
+            try:
+                with open(os.path.join(self.directory, "meta.json"), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except FileNotFoundError:
+                return  # A rebuild is being swapped in; keep serving what we have
+            if meta["build_id"] != self._build_id:
+                self._reset()
+                self._build_id = meta["build_id"]
+                self.dim = meta["dim"]
+
+            records_path = os.path.join(self.directory, "records.jsonl")
+            if os.path.getsize(records_path) > self._offset:
+                self._load_tail(records_path)
+
+    def _load_tail(self, records_path):
+        with open(records_path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        end = chunk.rfind(b"\n") + 1   # ignore a line that is still being written
+        if not end:
+            return
+        self._offset += end
+
+        alive = list(self._alive)
+        codes = list(self._source_codes)
+        for line in chunk[:end].decode("utf-8").splitlines():
+            record = json.loads(line)
+            uid = record["id"]
+            current = self._row_of.get(uid)
+            if "row" in record:
+                if current is not None:
+                    alive[current] = False
+                # Slots are vector rows. Rows without a record (an append
+                # interrupted between the two files) stay dead placeholders.
+                row = record["row"]
+                while len(self._ids) <= row:
+                    self._ids.append(None)
+                    self._documents.append(None)
+                    self._metadatas.append({})
+                    alive.append(False)
+                    codes.append(-1)
+                self._ids[row] = uid
+                self._documents[row] = record["document"]
+                self._metadatas[row] = record["metadata"] or {}
+                alive[row] = True
+                codes[row] = _source_code(record["metadata"])
+                self._row_of[uid] = row
+            elif current is not None and record.get("delete"):
+                alive[current] = False
+                del self._row_of[uid]
+            elif current is not None and "patch" in record:
+                self._metadatas[current] = {**self._metadatas[current], **record["patch"]}
+
+        self._alive = np.array(alive, dtype=bool)
+        self._source_codes = np.array(codes, dtype=np.int8)
+        self._columns = {}
+        rows = len(self._ids)
+        if rows and self.dim is None:
+            self.dim = os.path.getsize(os.path.join(self.directory, "vectors.f32")) // (4 * rows)
+        self._matrix = np.memmap(os.path.join(self.directory, "vectors.f32"), dtype=np.float32, mode="r",
+                                 shape=(rows, self.dim)) if rows else None
+
+    def _column(self, key):
+        """
+        One metadata key as an array (object dtype, None where missing), cached
+        until the next refresh.
+        """
+        column = self._columns.get(key)
+        if column is None:
+            column = np.array([m.get(key) for m in self._metadatas], dtype=object)
+            self._columns[key] = column
+        return column
+
+    def _where_mask(self, where):
+        """
+        Boolean mask for the subset of Chroma's where syntax the router uses
+        ($and, $or, equality, $eq/$ne/$gte/$lte/$gt/$lt/$in).
+        """
+        n = len(self._ids)
+        if not where:
+            return np.ones(n, dtype=bool)
+        if "$and" in where:
+            mask = np.ones(n, dtype=bool)
+            for clause in where["$and"]:
+                mask &= self._where_mask(clause)
+            return mask
+        if "$or" in where:
+            mask = np.zeros(n, dtype=bool)
+            for clause in where["$or"]:
+                mask |= self._where_mask(clause)
+            return mask
+
+        (key, condition), = where.items()
+        column = self._column(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        (op, target), = condition.items()
+        if op == "$eq":
+            return column == target
+        if op == "$ne":
+            return column != target
+        if op == "$in":
+            return np.isin(column, list(target))
+        present = np.array([v is not None for v in column], dtype=bool)
+        values = np.where(present, column, 0).astype(np.float64)
+        compare = {"$gte": np.greater_equal, "$lte": np.less_equal,
+                   "$gt": np.greater, "$lt": np.less}[op]
+        return present & compare(values, target)
+
+    def query(self, source_type, query_embeddings, n_results, where=None):
+        """
+        Exact top-k. Same result shape as query_source(); distances are
+        squared L2 between normalised vectors (2 - 2 * cosine).
+        """
+        self.refresh()
+        queries = _normalize(query_embeddings)
+        out = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+
+        with self._lock:
+            rows = len(self._ids)
+            mask = self._alive & (self._source_codes == _source_code({"source_type": source_type}))
+            if where:
+                mask &= self._where_mask(where)
+            candidates = np.flatnonzero(mask)
+            k = min(n_results, candidates.size)
+            if not rows or not k:
+                for _ in range(len(queries)):
+                    for key in out:
+                        out[key].append([])
+                return out
+
+            # Dense product over the candidates only when the filter is selective
+            if candidates.size < rows // 2:
+                scores = queries @ np.asarray(self._matrix[candidates]).T
+                row_map = candidates
+            else:
+                scores = queries @ self._matrix.T
+                scores[:, ~mask] = -np.inf
+                row_map = None
+
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for q in range(len(queries)):
+                order = top[q][np.argsort(-scores[q, top[q]])]
+                picked = row_map[order] if row_map is not None else order
+                out["ids"].append([self._ids[r] for r in picked])
+                out["documents"].append([self._documents[r] for r in picked])
+                out["metadatas"].append([self._metadatas[r] for r in picked])
+                out["distances"].append([max(0.0, float(2 - 2 * s)) for s in scores[q, order]])
+        return out
+
+    def stats(self):
+        self.refresh()
+        return {"rows": len(self._ids), "alive": int(self._alive.sum()), "dim": self.dim}
+
+
+def _source_code(metadata):
+    source_type = (metadata or {}).get("source_type")
+    return vector_store.SOURCE_TYPES.index(source_type) if source_type in vector_store.SOURCE_TYPES else -1
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(base):
+    index = _indexes.get(base)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(base)
+            if index is None:
+                index = NumpyIndex(base)
+                _indexes[base] = index
+    return index
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    base = vector_store.active_generation()["collection"]
+    if command == "build":
+        build(base)
+    elif not index_exists(base):
+        print(f"❌ No NumPy index for '{base}'. Run: python numpy_index.py build")
+    else:
+        print(f"📊 {base}: {get_index(base).stats()}")
@@ -0,0 +1,122 @@
+"""
+Quantized ONNX backend for all-MiniLM-L6-v2 (CPU only, no PyTorch).
+
+Select it with EMBEDDING_BACKEND=onnx-int8 (see vector_store.py).
+The int8 model is produced once with:
+
+    python onnx_embeddings.py prepare
+
+which takes the fp32 ONNX export Chroma already ships for this model and runs
+ONNX Runtime dynamic quantization over it. If you have your own export (e.g.
+from `optimum-cli export onnx`), drop model.onnx + tokenizer.json into
+ONNX_MODEL_DIR and `prepare` will quantize that instead.
+"""
+import os
+import shutil
+import sys
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+
+# --- CONFIGURATION ---
+ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR", "./models/all-MiniLM-L6-v2-onnx")
+FP32_MODEL_FILE = "model.onnx"
+INT8_MODEL_FILE = "model_int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+MAX_SEQ_LENGTH = 256  # Same limit sentence-transformers uses for this model
+BATCH_SIZE = 32
+
+
+def prepare_quantized_model(model_dir=ONNX_MODEL_DIR):
+    """
+    Makes sure model_dir contains the int8 model and tokenizer.
+    Returns the path to the int8 model.
+    """
+    int8_path = os.path.join(model_dir, INT8_MODEL_FILE)
+    if os.path.exists(int8_path) and os.path.exists(os.path.join(model_dir, TOKENIZER_FILE)):
+        return int8_path
+
+    os.makedirs(model_dir, exist_ok=True)
+    fp32_path = os.path.join(model_dir, FP32_MODEL_FILE)
+
+    # 1. Get an fp32 export (reuse the one Chroma downloads for its default EF)
+    if not os.path.exists(fp32_path):
+        from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+        print("⬇️  Fetching fp32 ONNX export of all-MiniLM-L6-v2...")
+        source = ONNXMiniLM_L6_V2()
+        source(["download"])  # Triggers the download on first use
+        source_dir = os.path.join(source.DOWNLOAD_PATH, source.EXTRACTED_FOLDER_NAME)
+        for name in (FP32_MODEL_FILE, TOKENIZER_FILE):
+            shutil.copy(os.path.join(source_dir, name), os.path.join(model_dir, name))
+
+    # 2. Dynamic int8 quantization (weights int8, activations quantized at runtime)
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    print("⚙️  Quantizing to int8...")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"✅ Saved: {int8_path}")
+    return int8_path
+
+
+class QuantizedOnnxEmbeddingFunction(EmbeddingFunction):
+    """
+    Drop-in replacement for SentenceTransformerEmbeddingFunction(all-MiniLM-L6-v2).
+    Mean pooling + L2 normalisation, same as the sentence-transformers pipeline,
+    so vectors land in the same space as the existing collection.
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, batch_size=BATCH_SIZE, num_threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path = prepare_quantized_model(model_dir)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self._session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self._session.get_inputs()}
+
+        self._tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self._tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self._tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        self._batch_size = batch_size
+
+    def _embed_batch(self, texts):
+        encoded = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        last_hidden = self._session.run(None, feeds)[0]
+
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (last_hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    def __call__(self, input):
+        texts = list(input)
+        if not texts:
+            return []
+
+        # Batch texts of similar length together so padding stays small,
+        # then put the results back in the caller's order.
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        result = [None] * len(texts)
+        for start in range(0, len(order), self._batch_size):
+            batch_idx = order[start:start + self._batch_size]
+            vectors = self._embed_batch([texts[i] for i in batch_idx])
+            for i, vec in zip(batch_idx, vectors):
+                result[i] = vec
+        return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "prepare":
+        prepare_quantized_model()
+    else:
+        print("Usage: python onnx_embeddings.py prepare")
@@ -1,11 +1,17 @@
 import time
 import os
+import sys
 from pathlib import Path  # <--- The Modern Fix
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
 # --- IMPORTS ---
+# Both modules are cheap to import now: Chroma, the embedding model and the
+# Gemini client are only created the first time a file actually needs them.
+import profiling
+import vector_store
 from ingest_vectors import ingest_single_file
+from work_claims import get_claims, print_report
 try:
     from batch_processor import process_single_file
 except ImportError:
@@ -23,13 +29,20 @@ DIRS = {
     "proc_inst":     BASE_DIR / "data" / "institutional" / "processed"
 }
 
+# Several watchers (on one or more hosts) can share data/: every file is
+# claimed with a lease before it is processed or ingested (see work_claims.py).
+# Leases left behind by a crashed worker are picked up by this sweep.
+RECLAIM_INTERVAL = 60  # seconds
+
 class PipelineHandler(FileSystemEventHandler):
     def on_created(self, event):
         if event.is_directory: return
+        self.handle_path(event.src_path)
 
+    def handle_path(self, src_path, settle=True):
         # Convert the incoming string path to a Path Object
         # This standardizes it immediately
-        file_path = Path(event.src_path)
+        file_path = Path(src_path)
         filename = file_path.name
         
         # Ignore temp files
@@ -42,7 +55,8 @@ class PipelineHandler(FileSystemEventHandler):
         parent_dir = file_path.parent
 
         # Wait for file write to complete
-        time.sleep(1)
+        if settle:
+            time.sleep(1)
 
         # --- LOGIC: Compare Path Objects (Not Strings) ---
         
@@ -71,8 +85,31 @@ class PipelineHandler(FileSystemEventHandler):
             print(f"      File is in: {parent_dir}")
             print(f"      We want:    {DIRS['raw_retail']}")
 
-def start_pipeline():
+def reclaim_expired(handler):
+    """
+    Re-dispatches files whose worker stopped heartbeating (crashed, killed,
+    host went down). handle_path() claims them again like any new file.
+    A lease that is still expired afterwards was not picked up (output
+    already exists, failure-ledger backoff, file deleted): drop it so it
+    isn't re-dispatched on every sweep.
+    """
+    claims = get_claims()
+    for key, path, worker in claims.expired():
+        if path and os.path.exists(path):
+            print(f"\n♻️ Lease on {key} expired (was {worker}) -> retrying")
+            handler.handle_path(path, settle=False)
+        if claims.drop_expired(key):
+            print(f"   🧹 Cleared stale lease on {key}")
+
+def start_pipeline(warmup=False):
     observer = Observer()
+    handler = PipelineHandler()
+    print(f"👷 Worker: {get_claims().worker}")
+
+    # Optional: load the embedding model in the background so the first
+    # processed JSON doesn't wait for it. Raw-only watchers can skip this.
+    if warmup:
+        vector_store.warm_up(background=True)
     
     # Schedule watchers for all 4 folders
     for key, path_obj in DIRS.items():
@@ -80,7 +117,7 @@ def start_pipeline():
         path_obj.mkdir(parents=True, exist_ok=True)
         
         # Watchdog needs string paths, not Path objects
-        observer.schedule(PipelineHandler(), str(path_obj), recursive=False)
+        observer.schedule(handler, str(path_obj), recursive=False)
         print(f"🔭 Watching: {path_obj}")
 
     observer.start()
@@ -88,13 +125,19 @@ def start_pipeline():
     print("   [Ctrl+C to stop]")
 
     try:
+        last_sweep = 0.0
         while True:
             time.sleep(1)
+            if time.time() - last_sweep >= RECLAIM_INTERVAL:
+                last_sweep = time.time()
+                reclaim_expired(handler)
     except KeyboardInterrupt:
         observer.stop()
         print("\n🛑 Pipeline stopped.")
+        print_report()
     
     observer.join()
 
 if __name__ == "__main__":
-    start_pipeline()
\ No newline at end of file
+    profiling.start("pipeline_watcher")  # PROFILE=1 or --profile; written on Ctrl+C
+    start_pipeline(warmup="--warmup" in sys.argv)
\ No newline at end of file
@@ -0,0 +1,185 @@
+"""
+Built-in sampling profiler for the pipeline's hot paths.
+
+Turn it on with the PROFILE=1 environment variable or --profile on the command
+line of batch_processor, ingest_vectors, pipeline_watcher,
+institutional_scraper or rag_agent. When on, a daemon thread samples every
+thread's Python stack every PROFILE_INTERVAL_MS and, when the process exits,
+writes profiles/<run>_<timestamp>_<pid>.folded in the collapsed-stack format
+("frame;frame;frame count") that flamegraph.pl, inferno and speedscope read:
+
+    flamegraph.pl profiles/ingest_vectors_*.folded > ingest.svg
+
+The expensive sections are tagged with `with profiling.section("embedding"):`
+(pdfplumber.extract_text, embedding, chroma.upsert, chroma.query, numpy.query,
+json.parse, llm.generate). Samples taken inside a section get a
+"[section]" frame right under the thread name, and wall time per section is
+printed at exit.
+
+When profiling is off, section() returns a shared no-op context manager:
+the cost is one global lookup and an empty `with`.
+"""
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from env_flags import env_flag
+
+# --- CONFIGURATION ---
+PROFILE_DIR = "profiles"
+PROFILE_INTERVAL_MS = 5
+MAX_STACK_DEPTH = 128
+
+_sampler = None
+
+
+class _NullSection:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SECTION = _NullSection()
+
+
+class _Section:
+    __slots__ = ("sampler", "name", "stack", "start")
+
+    def __init__(self, sampler, name, stack):
+        self.sampler = sampler
+        self.name = name
+        self.stack = stack
+
+    def __enter__(self):
+        self.stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        # The sampler may have been stopped (and its totals printed) while
+        # this section was open, e.g. a worker thread still running at exit
+        if not self.sampler.stopped():
+            self.sampler.record_section(self.name, time.perf_counter() - self.start)
+        self.stack.pop()
+        return False
+
+
+def section(name):
+    """
+    Tags a hot section: with profiling.section("chroma.query"): ...
+    """
+    sampler = _sampler
+    if sampler is None:
+        return _NULL_SECTION
+    return _Section(sampler, name, sampler.section_stack())
+
+
+class Sampler:
+    def __init__(self, run_name, interval):
+        self.run_name = run_name
+        self.interval = interval
+        self.samples = Counter()
+        self.section_time = Counter()
+        self.section_calls = Counter()
+        self._sections = {}          # thread id -> list of open section names
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+        self.started = time.time()
+
+    def section_stack(self):
+        ident = threading.get_ident()
+        stack = self._sections.get(ident)
+        if stack is None:
+            stack = self._sections.setdefault(ident, [])
+        return stack
+
+    def record_section(self, name, seconds):
+        with self._lock:
+            self.section_time[name] += seconds
+            self.section_calls[name] += 1
+
+    def stopped(self):
+        return self._stop.is_set()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.reverse()
+                sections = self._sections.get(ident)
+                prefix = [f"[{s}]" for s in sections] if sections else []
+                self.samples[";".join([names.get(ident, "thread")] + prefix + stack)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=1)
+
+    def write(self, directory=PROFILE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(self.started))
+        path = os.path.join(directory, f"{self.run_name}_{stamp}_{os.getpid()}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def requested(argv=None):
+    argv = sys.argv if argv is None else argv
+    return "--profile" in argv or env_flag("PROFILE", False)
+
+
+def start(run_name, force=False):
+    """
+    Starts sampling if PROFILE / --profile asked for it (or force=True).
+    The folded-stack file is written when the process exits.
+    """
+    global _sampler
+    if _sampler is not None or not (force or requested()):
+        return False
+    interval = float(os.environ.get("PROFILE_INTERVAL_MS", PROFILE_INTERVAL_MS)) / 1000
+    _sampler = Sampler(run_name, interval)
+    _sampler.start()
+    atexit.register(stop)
+    print(f"🔬 Profiling '{run_name}' (sampling every {interval * 1000:.0f} ms)")
+    return True
+
+
+def stop():
+    """
+    Stops sampling, writes the folded stacks and prints time per section.
+    """
+    global _sampler
+    sampler, _sampler = _sampler, None
+    if sampler is None:
+        return None
+    sampler.stop()
+    path = sampler.write()
+    total = sum(sampler.samples.values())
+    print(f"\n🔬 Profile: {total} samples -> {path}")
+    for name, seconds in sampler.section_time.most_common():
+        calls = sampler.section_calls[name]
+        print(f"   {name:<18} {seconds:>9.3f}s  {calls:>6} calls  {seconds / calls * 1000:>9.2f} ms/call")
+    return path
@@ -0,0 +1,358 @@
+"""
+Asyncio query service shared by the Streamlit UI (app.py) and the CLI (rag_agent.py).
+
+- Retrieval runs in worker threads (Chroma + the embedding model are blocking)
+- Identical in-flight requests are coalesced (single-flight): if five analysts
+  ask the same question at once, only one retrieval and one Gemini call happen
+  and all five get the same result
+- LLM calls are capped by a semaphore and every stage has a timeout
+- Parallel-perspective mode (analyze_sections): the institutional and retail
+  summaries are generated concurrently on their own (smaller) contexts, maybe
+  on different models, then a short divergence step compares the two
+  summaries. Each section is handed to the caller as soon as it is ready.
+
+The service lives on one event loop in a background thread, so Streamlit's
+per-session script threads (and the CLI) just submit work to it with the
+*_sync helpers and wait for the result.
+"""
+import asyncio
+import os
+import queue
+import threading
+
+import vector_store
+
+# --- CONFIGURATION ---
+DEFAULT_MODEL = "gemma-3-12b-it"
+N_RESULTS = 15
+MAX_LLM_CONCURRENCY = 4
+RETRIEVAL_TIMEOUT = 30    # seconds
+LLM_TIMEOUT = 120         # seconds
+NO_DATA = "No relevant data found."
+
+SECTIONS = ("institutional", "retail", "divergence")
+SECTION_TITLES = {
+    "institutional": "### 🏛️ Institutional Perspective",
+    "retail": "### 🗣️ Retail/Market Sentiment",
+    "divergence": "### ⚖️ Analysis of Divergence",
+}
+
+# --- API SETUP (Lazy) ---
+_client = None
+_client_lock = threading.Lock()
+
+def get_gemini_client():
+    """
+    Creates the Gemini client on first use instead of at import time.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                api_key = os.environ.get("GEMINI_API_KEY")
+                if not api_key:
+                    raise ValueError("API Key not found! Check your .env file.")
+                from google import genai
+                _client = genai.Client(api_key=api_key)
+    return _client
+
+
+# --- PROMPT ---
+def format_context(docs):
+    context_text = ""
+    for doc in docs:
+        context_text += f"- {doc}\n"
+    return context_text if context_text else NO_DATA
+
+def build_comparison_prompt(query, retail_ctx, inst_ctx):
+    return f"""
+    You are a Financial Analyst System. You have access to two distinct datasets.
+
+    USER QUESTION: {query}
+
+    DATASET 1: INSTITUTIONAL (Official Reports, Principles)
+    {inst_ctx}
+
+    DATASET 2: RETAIL (Social Sentiment, YouTube Opinions)
+    {retail_ctx}
+
+    INSTRUCTIONS:
+    Please provide your response in the following strict format:
+
+    ### 🏛️ Institutional Perspective
+    (Summarize the findings from Dataset 1. Focus on facts, fundamentals, and risk.)
+
+    ### 🗣️ Retail/Market Sentiment
+    (Summarize the findings from Dataset 2. Focus on opinions, hype, and psychology.)
+
+    ### ⚖️ Analysis of Divergence
+    (Compare the two. Are they agreeing? Is the retail crowd ignoring a risk the institutions see? Or vice versa?)
+    """
+
+
+def build_perspective_prompt(query, source_type, context):
+    if source_type == "institutional":
+        dataset = "INSTITUTIONAL (Official Reports, Principles)"
+        focus = "Focus on facts, fundamentals, and risk."
+    else:
+        dataset = "RETAIL (Social Sentiment, YouTube Opinions)"
+        focus = "Focus on opinions, hype, and psychology."
+    return f"""
+    You are a Financial Analyst System.
+
+    USER QUESTION: {query}
+
+    DATASET: {dataset}
+    {context}
+
+    INSTRUCTIONS:
+    Summarize what this dataset says about the question in a few short paragraphs
+    or bullet points. {focus} Do not add a heading.
+    """
+
+def build_divergence_prompt(query, inst_summary, retail_summary):
+    return f"""
+    You are a Financial Analyst System.
+
+    USER QUESTION: {query}
+
+    INSTITUTIONAL SUMMARY:
+    {inst_summary}
+
+    RETAIL SUMMARY:
+    {retail_summary}
+
+    INSTRUCTIONS:
+    In one or two short paragraphs, compare the two. Are they agreeing? Is the retail
+    crowd ignoring a risk the institutions see? Or vice versa? Do not add a heading.
+    """
+
+def section_models(model=DEFAULT_MODEL, overrides=None):
+    """
+    {section: model} for parallel-perspective mode. overrides come from the
+    caller (app.py sidebar, rag_agent --section-models); sections without one
+    use the model chosen for the request.
+    """
+    models = {section: model for section in SECTIONS}
+    models.update({k: v for k, v in (overrides or {}).items() if v})
+    return models
+
+def assemble_sections(sections):
+    return "\n\n".join(f"{SECTION_TITLES[s]}\n{sections[s]}" for s in SECTIONS if s in sections)
+
+
+# --- SERVICE ---
+def _normalize(query):
+    return " ".join(query.lower().split())
+
+
+class QueryService:
+    def __init__(self, max_llm_concurrency=MAX_LLM_CONCURRENCY,
+                 retrieval_timeout=RETRIEVAL_TIMEOUT, llm_timeout=LLM_TIMEOUT):
+        self.retrieval_timeout = retrieval_timeout
+        self.llm_timeout = llm_timeout
+        self._llm_semaphore = asyncio.Semaphore(max_llm_concurrency)
+        self._inflight = {}
+        self.stats = {"requests": 0, "coalesced": 0, "llm_calls": 0}
+
+    async def _single_flight(self, key, factory):
+        """
+        Runs factory() once per key; concurrent callers with the same key
+        await the same task. shield() keeps one caller's timeout/cancel from
+        cancelling the work everyone else is waiting on.
+        """
+        self.stats["requests"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    async def retrieve(self, query, n=N_RESULTS):
+        """
+        Both sources, retrieved concurrently. Returns
+        {"institutional": {"documents", "metadatas"}, "retail": {...}}.
+        """
+        async def run():
+            # Embed once and reuse it for both sources. Pin the generation so
+            # an embedding-model switch mid-request can't mix vector spaces.
+            generation = vector_store.active_generation()
+            embedding = await asyncio.to_thread(
+                lambda: vector_store.embed([query], generation["model"])[0]
+            )
+
+            async def one(source_type):
+                results = await asyncio.to_thread(
+                    vector_store.search, source_type, query, n, query_embedding=embedding, generation=generation
+                )
+                return {
+                    "documents": results["documents"][0] if results["documents"] else [],
+                    "metadatas": results["metadatas"][0] if results["metadatas"] else [],
+                }
+
+            inst, retail = await asyncio.gather(one("institutional"), one("retail"))
+            return {"institutional": inst, "retail": retail}
+
+        key = ("retrieve", _normalize(query), n)
+        return await asyncio.wait_for(self._single_flight(key, run), self.retrieval_timeout)
+
+    async def generate(self, prompt, model=DEFAULT_MODEL):
+        """
+        One Gemini call, behind the concurrency cap and the LLM timeout.
+        """
+        async with self._llm_semaphore:
+            self.stats["llm_calls"] += 1
+            response = await asyncio.wait_for(
+                get_gemini_client().aio.models.generate_content(model=model, contents=prompt),
+                self.llm_timeout,
+            )
+            return response.text
+
+    async def analyze(self, query, model=DEFAULT_MODEL, n=N_RESULTS, retrieved=None):
+        """
+        Retrieval + dual-source comparison. Never raises for LLM problems:
+        returns {"query", "model", "retrieved", "answer", "error"}.
+        Pass `retrieved` if the caller already has the retrieval result.
+        """
+        async def run():
+            data = retrieved or await self.retrieve(query, n)
+            result = {"query": query, "model": model, "retrieved": data, "answer": None, "error": None}
+
+            inst_docs = data["institutional"]["documents"]
+            retail_docs = data["retail"]["documents"]
+            if not inst_docs and not retail_docs:
+                result["error"] = "No data found in either category."
+                return result
+
+            prompt = build_comparison_prompt(query, format_context(retail_docs), format_context(inst_docs))
+            try:
+                result["answer"] = await self.generate(prompt, model)
+            except asyncio.TimeoutError:
+                result["error"] = f"{model} did not answer within {self.llm_timeout}s."
+            except Exception as e:
+                result["error"] = f"Error communicating with Gemini: {e}"
+            return result
+
+        key = ("analyze", _normalize(query), model, n)
+        return await self._single_flight(key, run)
+
+
+    async def analyze_sections(self, query, model=DEFAULT_MODEL, n=N_RESULTS, retrieved=None,
+                               models=None, emit=None):
+        """
+        Parallel-perspective analysis. The two summaries run concurrently,
+        then the divergence step runs on the summaries only.
+        emit(section, text) is called as each section finishes.
+        Returns {"query", "models", "retrieved", "sections", "answer", "error"}.
+        Each section is coalesced on its own, so two questions that share
+        a retrieval and a model share that summary.
+        """
+        models = section_models(model, models)
+        data = retrieved or await self.retrieve(query, n)
+        result = {"query": query, "models": models, "retrieved": data, "sections": {},
+                  "answer": None, "error": None}
+
+        if not data["institutional"]["documents"] and not data["retail"]["documents"]:
+            result["error"] = "No data found in either category."
+            return result
+
+        async def generate_section(section, prompt):
+            try:
+                return await self.generate(prompt, models[section])
+            except asyncio.TimeoutError:
+                return f"⚠️ {models[section]} did not answer within {self.llm_timeout}s."
+            except Exception as e:
+                return f"⚠️ Error communicating with Gemini: {e}"
+
+        async def summary(source_type):
+            docs = data[source_type]["documents"]
+            if not docs:
+                text = NO_DATA
+            else:
+                prompt = build_perspective_prompt(query, source_type, format_context(docs))
+                key = ("section", _normalize(query), source_type, models[source_type], n)
+                text = await self._single_flight(key, lambda: generate_section(source_type, prompt))
+            result["sections"][source_type] = text
+            if emit:
+                emit(source_type, text)
+            return text
+
+        inst_summary, retail_summary = await asyncio.gather(summary("institutional"), summary("retail"))
+
+        prompt = build_divergence_prompt(query, inst_summary, retail_summary)
+        key = ("divergence", _normalize(query), models["institutional"], models["retail"], models["divergence"], n)
+        divergence = await self._single_flight(key, lambda: generate_section("divergence", prompt))
+        result["sections"]["divergence"] = divergence
+        if emit:
+            emit("divergence", divergence)
+
+        result["answer"] = assemble_sections(result["sections"])
+        return result
+
+
+# --- BACKGROUND LOOP (for sync callers) ---
+_runner_lock = threading.Lock()
+_loop = None
+_service = None
+
+def get_service():
+    """
+    Starts the service's event loop in a daemon thread on first use.
+    Every caller in the process shares it, which is what makes coalescing
+    work across Streamlit sessions.
+    """
+    global _loop, _service
+    if _service is None:
+        with _runner_lock:
+            if _service is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="query-service", daemon=True).start()
+                # Build the service on its own loop
+                _service = asyncio.run_coroutine_threadsafe(_create_service(), loop).result()
+                _loop = loop
+    return _service
+
+async def _create_service():
+    return QueryService()
+
+def _submit(coro, timeout):
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result(timeout)
+
+def retrieve_sync(query, n=N_RESULTS):
+    service = get_service()
+    return _submit(service.retrieve(query, n), service.retrieval_timeout + 5)
+
+def analyze_sync(query, model=DEFAULT_MODEL, n=N_RESULTS, retrieved=None):
+    service = get_service()
+    timeout = service.retrieval_timeout + service.llm_timeout + 5
+    return _submit(service.analyze(query, model, n, retrieved), timeout)
+
+def analyze_sections_iter(query, model=DEFAULT_MODEL, n=N_RESULTS, retrieved=None, models=None):
+    """
+    Sync generator over analyze_sections(): yields (section, text) as each
+    section is ready, then ("done", result). Raises TimeoutError like the
+    other *_sync helpers.
+    """
+    service = get_service()
+    ready = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        service.analyze_sections(query, model, n, retrieved, models, emit=lambda s, t: ready.put((s, t))),
+        _loop,
+    )
+    future.add_done_callback(lambda _: ready.put(("done", None)))
+
+    # Retrieval, then the summaries, then the divergence step
+    deadline = service.retrieval_timeout + 2 * service.llm_timeout + 5
+    while True:
+        try:
+            section, text = ready.get(timeout=deadline)
+        except queue.Empty:
+            future.cancel()
+            raise TimeoutError("Timed out waiting for the analysis.")
+        if section == "done":
+            yield "done", future.result()
+            return
+        yield section, text
@@ -1,113 +1,238 @@
-import os
-import chromadb
-from chromadb.utils import embedding_functions
-from google import genai
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
+# Retrieval, prompting and the Gemini client live in query_service; this
+# module is the CLI (interactive + batch evaluation) on top of it.
+import profiling
+import query_service
+import vector_store
+from query_service import (
+    DEFAULT_MODEL, N_RESULTS, SECTION_TITLES, build_comparison_prompt, format_context, get_gemini_client,
+)
+
 # Load .env
 load_dotenv()
 
-# --- CONFIGURATION ---
-DB_PATH = "./chroma_db"
-COLLECTION_NAME = "financial_knowledge"
-EMBEDDING_MODEL = "all-MiniLM-L6-v2"
-
-# --- API SETUP ---
-api_key = os.environ.get("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("API Key not found! Check your .env file.")
-
-client = genai.Client(api_key=api_key)
+# --- BATCH EVALUATION MODE ---
+class RateLimiter:
+    """
+    Spaces out calls so we never exceed `rpm` requests per minute,
+    no matter how many worker threads share it.
+    """
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
 
-# --- CHROMA SETUP ---
-chroma_client = chromadb.PersistentClient(path=DB_PATH)
-ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL)
-collection = chroma_client.get_collection(name=COLLECTION_NAME, embedding_function=ef)
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
 
-def retrieve_filtered(query, source_type, n=15):
+def load_questions(path):
     """
-    Retrieves context SPECIFICALLY for one source type.
+    Plain text (one question per line) or JSONL with a "question" field.
     """
-    print(f"  ...searching {source_type} data...")
-    
-    results = collection.query(
-        query_texts=[query],
-        n_results=n,
-        where={"source_type": source_type} # <--- THE MAGIC FILTER
-    )
-
-    context_text = ""
-    if results['documents']:
-        docs = results['documents'][0]
-        # We don't need to fetch metadata for source_type here since we know it!
-        for doc in docs:
-            context_text += f"- {doc}\n"
-    
-    return context_text if context_text else "No relevant data found."
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                questions.append(json.loads(line)["question"])
+            else:
+                questions.append(line)
+    return questions
 
-def generate_comparison(query, retail_ctx, inst_ctx):
+def generate_with_usage(prompt, model, limiter, max_retries=3, timings=None):
     """
-    Asks Gemini to analyze both sides separately.
+    Rate-limited generate_content that also returns token counts.
+    `timings` (a dict) gets wait_s (rate limiter + retry backoff) and
+    generation_s (time inside the API calls), even when the call fails.
     """
-    print("🤖 Analyzing differences...")
-    
-    prompt = f"""
-    You are a Financial Analyst System. You have access to two distinct datasets.
-    
-    USER QUESTION: {query}
-    
-    DATASET 1: INSTITUTIONAL (Official Reports, Principles)
-    {inst_ctx}
-    
-    DATASET 2: RETAIL (Social Sentiment, YouTube Opinions)
-    {retail_ctx}
-    
-    INSTRUCTIONS:
-    Please provide your response in the following strict format:
-    
-    ### 🏛️ Institutional Perspective
-    (Summarize the findings from Dataset 1. Focus on facts, fundamentals, and risk.)
-    
-    ### 🗣️ Retail/Market Sentiment
-    (Summarize the findings from Dataset 2. Focus on opinions, hype, and psychology.)
-    
-    ### ⚖️ Analysis of Divergence
-    (Compare the two. Are they agreeing? Is the retail crowd ignoring a risk the institutions see? Or vice versa?)
+    timings = timings if timings is not None else {}
+    timings.update(wait_s=0.0, generation_s=0.0)
+    for attempt in range(max_retries):
+        wait_start = time.perf_counter()
+        limiter.wait()
+        timings["wait_s"] += time.perf_counter() - wait_start
+        call_start = time.perf_counter()
+        try:
+            response = get_gemini_client().models.generate_content(model=model, contents=prompt)
+            timings["generation_s"] += time.perf_counter() - call_start
+            usage = getattr(response, "usage_metadata", None)
+            return response.text, {
+                "prompt_tokens": getattr(usage, "prompt_token_count", None),
+                "output_tokens": getattr(usage, "candidates_token_count", None),
+                "total_tokens": getattr(usage, "total_token_count", None),
+            }
+        except Exception as e:
+            timings["generation_s"] += time.perf_counter() - call_start
+            err_msg = str(e)
+            retryable = "429" in err_msg or "503" in err_msg or "UNAVAILABLE" in err_msg
+            if not retryable or attempt == max_retries - 1:
+                raise
+            wait_time = (attempt + 1) * 10
+            print(f"⏳ {model} busy/rate limited. Sleeping {wait_time}s...")
+            time.sleep(wait_time)
+            timings["wait_s"] += wait_time
+
+def run_batch_eval(questions_path, output_path, model=DEFAULT_MODEL, concurrency=4, rpm=30, n=N_RESULTS):
+    """
+    Non-interactive mode: embed every question in one batch, run retrieval for
+    both sources as batched Chroma queries, then generate answers concurrently
+    (capped at `rpm`). One JSONL line per question, written as answers finish.
+    Retrieval is only measurable for the whole batch: each record carries
+    batch_retrieval_s and its share (retrieval_s). generation_s is that
+    question's own API time; wait_s is rate limiter + retry backoff.
     """
+    questions = load_questions(questions_path)
+    if not questions:
+        print(f"❌ No questions found in {questions_path}")
+        return
+    print(f"📋 {len(questions)} questions -> {output_path} ({model}, {concurrency} workers, {rpm} rpm)")
 
+    # 1. One embedding batch for everything
+    start = time.perf_counter()
+    generation = vector_store.active_generation()
+    embeddings = vector_store.embed(questions, generation["model"])
+    embed_s = time.perf_counter() - start
+    print(f"🧮 Embedded {len(questions)} questions in {embed_s:.2f}s")
+
+    # 2. Batched retrieval per source
+    retrieval_start = time.perf_counter()
+    inst_results = vector_store.search_batch("institutional", questions, n, query_embeddings=embeddings,
+                                             generation=generation)
+    retail_results = vector_store.search_batch("retail", questions, n, query_embeddings=embeddings,
+                                               generation=generation)
+    batch_retrieval_s = time.perf_counter() - retrieval_start
+    retrieval_share = batch_retrieval_s / len(questions)
+    print(f"🔍 Retrieval done in {batch_retrieval_s:.2f}s ({retrieval_share * 1000:.0f} ms/question)")
+
+    limiter = RateLimiter(rpm)
+
+    def answer(index):
+        inst_docs = inst_results[index]["documents"][0]
+        retail_docs = retail_results[index]["documents"][0]
+        record = {
+            "index": index,
+            "question": questions[index],
+            "model": model,
+            "n_institutional": len(inst_docs),
+            "n_retail": len(retail_docs),
+            "batch_retrieval_s": round(batch_retrieval_s, 4),
+            "retrieval_s": round(retrieval_share, 4),
+            "answer": None,
+            "error": None,
+        }
+        timings = {"wait_s": 0.0, "generation_s": 0.0}
+        if not inst_docs and not retail_docs:
+            record["error"] = "No data found in either category."
+        else:
+            prompt = build_comparison_prompt(questions[index], format_context(retail_docs), format_context(inst_docs))
+            try:
+                record["answer"], usage = generate_with_usage(prompt, model, limiter, timings=timings)
+                record.update(usage)
+            except Exception as e:
+                record["error"] = str(e)
+        record["wait_s"] = round(timings["wait_s"], 4)
+        record["generation_s"] = round(timings["generation_s"], 4)
+        record["latency_s"] = round(record["retrieval_s"] + record["generation_s"], 4)
+        return record
+
+    # 3. Concurrent generation, results streamed to disk
+    done = 0
+    with open(output_path, "w", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(answer, i) for i in range(len(questions))]
+        for future in as_completed(futures):
+            record = future.result()
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            done += 1
+            status = "✅" if not record["error"] else "❌"
+            print(f"{status} [{done}/{len(questions)}] {record['latency_s']:.1f}s  {record['question'][:60]}")
+
+    print(f"\n🎉 Batch complete in {time.perf_counter() - start:.1f}s. Results: {output_path}")
+
+def run_parallel_query(query, model, n, section_models):
+    """
+    Prints each section as soon as the service has it.
+    """
+    start = time.perf_counter()
     try:
-        response = client.models.generate_content(
-            model='gemma-3-12b-it',
-            contents=prompt
-        )
-        return response.text
-    except Exception as e:
-        return f"Error: {e}"
+        for section, text in query_service.analyze_sections_iter(query, model=model, n=n, models=section_models):
+            if section == "done":
+                if text["error"]:
+                    print(f"❌ {text['error']}")
+                continue
+            print(f"\n{SECTION_TITLES[section]}  ({time.perf_counter() - start:.1f}s)\n{text}")
+    except TimeoutError:
+        print("❌ Timed out waiting for the query service.")
+        return
+    print("\n" + "-" * 60)
 
 def main():
+    parser = argparse.ArgumentParser(description="Dual-Source Financial Analyst")
+    parser.add_argument("--questions", help="Batch mode: file with one question per line (or .jsonl)")
+    parser.add_argument("--output", default="rag_eval_results.jsonl", help="Batch mode: JSONL results file")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--concurrency", type=int, default=4, help="Batch mode: parallel LLM calls")
+    parser.add_argument("--rpm", type=int, default=30, help="Batch mode: max LLM requests per minute")
+    parser.add_argument("--n", type=int, default=N_RESULTS, help="Results per source")
+    parser.add_argument("--no-warmup", action="store_true")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Generate the institutional and retail summaries concurrently, then the divergence")
+    parser.add_argument("--section-models", nargs=3, metavar=("INST", "RETAIL", "DIVERGENCE"),
+                        help="--parallel: model per section (default: --model for all three)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Sample hot sections and write a flamegraph-ready profile (or PROFILE=1)")
+    args = parser.parse_args()
+    profiling.start("rag_agent", force=args.profile)
+    section_models = dict(zip(("institutional", "retail", "divergence"), args.section_models or ()))
+
+    if args.questions:
+        run_batch_eval(args.questions, args.output, model=args.model,
+                       concurrency=args.concurrency, rpm=args.rpm, n=args.n)
+        return
+
     print("==================================================")
     print("   Dual-Source Financial Analyst (FYP Agent)      ")
     print("==================================================")
+
+    # Load the model while the user is still typing the first question
+    if not args.no_warmup:
+        vector_store.warm_up(background=True, create=False)
     
     while True:
         user_input = input("\nEnter Query (or 'exit'): ")
         if user_input.lower() in ['exit', 'quit']:
             break
             
-        # 1. Parallel Retrieval
-        print("\n🔍 Retrieving data...")
-        institutional_data = retrieve_filtered(user_input, "institutional")
-        retail_data = retrieve_filtered(user_input, "retail")
-        
-        # 2. Check if we found ANYTHING
-        if "No relevant data" in institutional_data and "No relevant data" in retail_data:
-            print("❌ No data found in either category.")
+        # 1. Retrieval + 2. Analysis (both sources in parallel, inside the service)
+        print("\n🔍 Retrieving data & 🤖 analyzing differences...")
+        if args.parallel:
+            run_parallel_query(user_input, args.model, args.n, section_models)
+            continue
+        try:
+            result = query_service.analyze_sync(user_input, model=args.model, n=args.n)
+        except TimeoutError:
+            print("❌ Timed out waiting for the query service.")
+            continue
+
+        # 3. Check if we found ANYTHING / print the answer
+        if result["error"]:
+            print(f"❌ {result['error']}")
             continue
-            
-        # 3. Generate Answer
-        answer = generate_comparison(user_input, retail_data, institutional_data)
         
-        print("\n" + answer + "\n")
+        print("\n" + result["answer"] + "\n")
         print("-" * 60)
 
 if __name__ == "__main__":
@@ -3,6 +3,8 @@ import os
 from youtube_transcript_api import YouTubeTranscriptApi
 from youtube_transcript_api.formatters import TextFormatter
 
+from failure_ledger import PERMANENT, get_ledger
+
 # Configuration
 SOURCE_FILE = "retail_sources.txt"
 OUTPUT_DIR = "data/retail/scraped"
@@ -28,6 +30,7 @@ def batch_scrape_retail():
         urls = [line.strip() for line in f if line.strip()]
 
     print(f"📋 Found {len(urls)} videos to process...")
+    ledger = get_ledger()
 
     for i, url in enumerate(urls):
         video_id = extract_video_id(url)
@@ -41,6 +44,12 @@ def batch_scrape_retail():
             print(f"⏭️  [Skipping] {video_id} - Already exists.")
             continue
 
+        # Known-unfetchable (transcripts disabled, removed...) or backing off
+        ledger_key = f"video:{video_id}"
+        if ledger.should_skip(ledger_key):
+            print(f"🚫 [Skipping] {video_id} - Known failure (see failure_ledger.py list).")
+            continue
+
         print(f"⬇️  [{i+1}/{len(urls)}] Fetching: {video_id}...")
 
         try:
@@ -55,12 +64,16 @@ def batch_scrape_retail():
                 f.write(text_formatted)
             
             print("   ✅ Saved!")
+            ledger.record_success(ledger_key)
 
             # BE POLITE - Wait 2 seconds between hits so YouTube doesn't block you
             time.sleep(2)
 
         except Exception as e:
             print(f"   ❌ Failed: {e}")
+            kind = ledger.record_failure(ledger_key, e, stage="retail_scraper")
+            if kind == PERMANENT:
+                print("   🚫 Permanent failure - won't retry for a while.")
 
 if __name__ == "__main__":
     batch_scrape_retail()
\ No newline at end of file
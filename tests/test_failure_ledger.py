@@ -0,0 +1,59 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from failure_ledger import PERMANENT, TRANSIENT, FailureLedger, classify, model_not_found
+
+
+def json_error_mentioning_404():
+    # A malformed model response whose parse error points at column 404
+    text = "[" + " " * 400 + "1 2]"
+    try:
+        json.loads(text)
+    except json.JSONDecodeError as e:
+        return e
+    raise AssertionError("expected a JSONDecodeError")
+
+
+class ApiError(Exception):
+    def __init__(self, code, status, message):
+        super().__init__(f"{code} {status}. {message}")
+        self.code = code
+        self.status = status
+
+
+class ClassifyTest(unittest.TestCase):
+    def test_json_error_with_404_is_transient_and_not_model_level(self):
+        error = json_error_mentioning_404()
+        self.assertIn("404", str(error))
+        self.assertEqual(classify(error), TRANSIENT)
+        self.assertFalse(model_not_found(error))
+
+    def test_json_error_is_recorded_against_the_file_as_transient(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ledger = FailureLedger(os.path.join(tmp, "ledger.sqlite"))
+            kind = ledger.record_failure("file:retail/x.txt", json_error_mentioning_404(), stage="test")
+            self.assertEqual(kind, TRANSIENT)
+            self.assertFalse(ledger.should_skip("model:gemini-x"))
+
+    def test_api_not_found_is_model_level(self):
+        error = ApiError(404, "NOT_FOUND", "models/gemini-x is not found")
+        self.assertTrue(model_not_found(error))
+        self.assertEqual(classify(error), PERMANENT)
+
+    def test_404_inside_ids_and_paths_is_transient(self):
+        self.assertEqual(classify("Timeout fetching https://youtube.com/watch?v=ab404cd"), TRANSIENT)
+        self.assertEqual(classify("File data/retail/404_notes.txt locked"), TRANSIENT)
+        self.assertFalse(model_not_found(RuntimeError("404 NOT_FOUND")))
+
+    def test_status_codes_from_messages(self):
+        self.assertEqual(classify(ApiError(429, "RESOURCE_EXHAUSTED", "quota")), TRANSIENT)
+        self.assertEqual(classify("HTTP Error 404: Not Found"), PERMANENT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from near_dedup import BANDS, NearDuplicateIndex, minhash_signature
+
+TEXT = "dividend snowball: reinvest every payout into the same counter for years"
+
+
+class BandsTest(unittest.TestCase):
+    def test_re_adding_a_unit_does_not_repeat_band_rows(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            index = NearDuplicateIndex(os.path.join(tmp, "index.sqlite"))
+            signature = minhash_signature(TEXT)
+            for _ in range(2):
+                with index.transaction():
+                    index.add("u1", "retail", "c", signature, "vid1")
+            count = index._conn.execute("SELECT COUNT(*) FROM bands").fetchone()[0]
+            self.assertEqual(count, BANDS)
+            self.assertEqual(index.find("retail", signature), "u1")
+
+    def test_old_index_is_deduplicated_and_made_unique(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "index.sqlite")
+            conn = sqlite3.connect(path)
+            conn.executescript("""
+                CREATE TABLE bands (band_key TEXT NOT NULL, id TEXT NOT NULL);
+                INSERT INTO bands VALUES ('k', 'a'), ('k', 'a'), ('k', 'b');
+            """)
+            conn.commit()
+            conn.close()
+
+            index = NearDuplicateIndex(path)
+            rows = index._conn.execute("SELECT band_key, id FROM bands ORDER BY id").fetchall()
+            self.assertEqual(rows, [("k", "a"), ("k", "b")])
+            with self.assertRaises(sqlite3.IntegrityError):
+                index._conn.execute("INSERT INTO bands (band_key, id) VALUES ('k', 'a')")
+
+
+if __name__ == "__main__":
+    unittest.main()
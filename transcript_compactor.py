@@ -0,0 +1,194 @@
+"""
+Deterministic, local compaction of YouTube transcripts before LLM extraction.
+
+TextFormatter output is thousands of short caption lines full of pause
+particles, filler words and stutters. Sending that verbatim wastes most of
+the 30k-char window in batch_processor. This pass:
+  1. keeps the Title/Source/Published header as-is
+  2. drops caption noise ([音乐], [Music], ...) and pure-filler lines
+  3. strips filler (pause particles 呢/啊/嘛/哦... at the end of a clause,
+     leading 然后/就是说, um/uh/you know)
+  4. collapses repetition (stutters like 非常非常, "the the", repeated lines)
+  5. folds traditional characters to simplified (OpenCC if installed,
+     otherwise a built-in table of common characters)
+  6. merges the caption fragments back into sentences
+
+It is deliberately conservative: nothing that could be speech is removed.
+On the hand-captioned transcripts in data/retail/scraped that saves about
+1.3% of characters (511,479 -> 504,668), so long videos still get cut at
+the 30k-char prompt window. youtube_transcript_api returns non-overlapping
+segments for auto-generated captions too, so there is no rolling-caption
+overlap to trim there either.
+
+Usage:
+    python transcript_compactor.py data/retail/scraped/retail_xxx.txt   # preview one
+    python transcript_compactor.py --report                            # ratio over all transcripts
+"""
+import glob
+import os
+import re
+import sys
+
+# --- CONFIGURATION ---
+HEADER_KEYS = ("Title:", "Source:", "Published:")
+MAX_SENTENCE_CHARS = 80   # Start a new line once a merged sentence gets this long
+
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_NOISE = re.compile(r"\[[^\]]{0,20}\]|\([^)]{0,20}(?:music|applause|laughter)[^)]{0,20}\)|[♪♫]+", re.IGNORECASE)
+# A pause particle only counts as filler at the end of a clause ("里面呢，", "一下子的哈"):
+# inside a word it is part of the word (巴哈马, 马哈迪, 哈佛, 干嘛, 呢绒, 哈哈)
+_PARTICLE = r"(?:呢(?!绒)|啊|(?<!干)嘛|(?<![巴哈])哈(?![哈佛迪])|哦|呀|啦|喔|噢)"
+_TRAILING_PARTICLES = re.compile(rf"(?<=[{_CJK}A-Za-z0-9%]){_PARTICLE}+$")
+_INLINE_PARTICLES = re.compile(rf"(?<=[{_CJK}A-Za-z0-9%]){_PARTICLE}+(?=[\s,，。！？!?.、；;：:])")
+_LEADING_FILLERS = re.compile(
+    rf"^(?:然后呢|就是说|然后|那么呢|那么(?![多少大小好高低久快慢])|那(?=[我你他她它这就如])|嗯+|呃+|额+)(?=[{_CJK}A-Za-z0-9])"
+)
+_FILLER_ONLY_LINE = re.compile(r"^(?:嗯|呃|额|啊|哦|哈|对|好|ok|okay|um+|uh+|hmm+|erm)+[,.!?，。！？]*$", re.IGNORECASE)
+_EN_FILLERS = re.compile(r"\b(?:um+|uh+|erm|hmm+|you know|i mean)\b[,]?\s*", re.IGNORECASE)
+_CJK_STUTTER = re.compile(rf"([{_CJK}]{{2,4}})\1+")
+_EN_STUTTER = re.compile(r"\b(\w+)(?:\s+\1\b)+", re.IGNORECASE)
+_SENTENCE_END = "。！？!?.…"
+
+# Common traditional -> simplified characters (fallback when OpenCC is missing)
+_T2S_PAIRS = (
+    "們们個个來来時时會会對对說说這这為为於于學学國国與与經经發发問问點点開开關关長长現现無无種种動动"
+    "電电還还過过東东業业義义務务產产當当從从應应門门進进實实買买賣卖錢钱銀银號号際际機机處处數数據据"
+    "報报價价資资幣币場场體体總总結结營营運运額额稅税準准備备變变轉转讓让權权證证險险養养續续貨货匯汇"
+    "盤盘漲涨幾几較较屬属該该讀读認认識识議议論论聽听寫写覺觉見见視视頻频網网絡络頭头條条題题標标優优"
+    "勢势壞坏賬账費费貸贷債债願愿圖图書书記记載载碼码樣样態态導导師师紅红虧亏損损護护擁拥聯联團团隊队"
+    "邊边廠厂馬马銷销億亿萬万歲岁麼么裡里後后氣气車车爾尔區区縣县廣广藥药醫医療疗術术蘭兰華华雲云頂顶"
+    "豐丰齊齐雙双陳陈劍剑漢汉線线紀纪約约級级純纯紙纸細细組组織织終终給给統统絕绝維维綠绿緊紧練练縮缩"
+    "齡龄戰战隨随顧顾預预領领類类風风飛飞館馆騰腾驗验鬆松魚鱼鳥鸟黃黄齒齿龍龙歷历曆历廳厅彈弹強强歸归"
+    "測测濟济滿满漸渐灣湾獲获環环甦苏畫画盡尽確确礎础禮礼穩稳競竞築筑簡简籌筹糧粮亞亚"
+)
+_T2S_TABLE = str.maketrans({_T2S_PAIRS[i]: _T2S_PAIRS[i + 1] for i in range(0, len(_T2S_PAIRS), 2)})
+
+_converter = None
+
+def to_simplified(text):
+    """
+    Traditional -> simplified. Uses OpenCC when available (complete and
+    phrase-aware), otherwise the built-in character table.
+    """
+    global _converter
+    if _converter is None:
+        try:
+            import opencc
+            try:
+                cc = opencc.OpenCC("t2s")
+            except Exception:
+                cc = opencc.OpenCC("t2s.json")
+            _converter = cc.convert
+        except Exception:
+            _converter = lambda s: s.translate(_T2S_TABLE)
+    return _converter(text)
+
+
+def _split_header(text):
+    lines = text.splitlines()
+    header = []
+    while lines and (lines[0].startswith(HEADER_KEYS) or (header and not lines[0].strip())):
+        line = lines.pop(0)
+        if line.strip():
+            header.append(line)
+    return header, lines
+
+
+def _clean_line(line):
+    line = _NOISE.sub(" ", line)
+    line = " ".join(line.split())
+    if not line or _FILLER_ONLY_LINE.match(line):
+        return ""
+    line = _EN_FILLERS.sub("", line).strip()
+    line = _LEADING_FILLERS.sub("", line)
+    line = _TRAILING_PARTICLES.sub("", line)
+    line = _INLINE_PARTICLES.sub("", line)
+    line = _CJK_STUTTER.sub(r"\1", line)
+    line = _EN_STUTTER.sub(r"\1", line)
+    return line.strip(" ,，")
+
+
+def _is_ascii_word_char(ch):
+    return ch.isascii() and ch.isalnum()
+
+
+def _merge_sentences(lines):
+    sentences = []
+    current = ""
+    for line in lines:
+        if not current:
+            current = line
+        else:
+            last, first = current[-1], line[0]
+            if last in _SENTENCE_END or last in "，,；;：:":
+                sep = "" if not _is_ascii_word_char(first) else " "
+            elif _is_ascii_word_char(last) and _is_ascii_word_char(first):
+                sep = " "
+            else:
+                sep = "，"
+            current += sep + line
+
+        if len(current) >= MAX_SENTENCE_CHARS or current[-1] in _SENTENCE_END:
+            if current[-1] not in _SENTENCE_END:
+                current += "。" if re.search(rf"[{_CJK}]", current) else "."
+            sentences.append(current)
+            current = ""
+
+    if current:
+        sentences.append(current)
+    return sentences
+
+
+def compact_transcript(text):
+    """
+    Returns (compacted_text, stats). stats is stored in the processed JSON meta.
+    """
+    header, body = _split_header(text)
+
+    cleaned = []
+    for raw in body:
+        line = _clean_line(to_simplified(raw))
+        if not line:
+            continue
+        # Only exact repeats are dropped: a line that starts with the end of
+        # the previous one is usually a repeated subject or number, not noise
+        if cleaned and line == cleaned[-1]:
+            continue
+        cleaned.append(line)
+
+    sentences = _merge_sentences(cleaned)
+    compacted = "\n".join(header + ([""] if header else []) + sentences)
+
+    original_chars = len(text)
+    stats = {
+        "original_chars": original_chars,
+        "compacted_chars": len(compacted),
+        "original_lines": len(body),
+        "compacted_lines": len(sentences),
+        "compression_ratio": round(len(compacted) / original_chars, 4) if original_chars else 1.0,
+    }
+    return compacted, stats
+
+
+def report(pattern="data/retail/scraped/*.txt"):
+    total_before = total_after = 0
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        _, stats = compact_transcript(text)
+        total_before += stats["original_chars"]
+        total_after += stats["compacted_chars"]
+        print(f"   {os.path.basename(path):<32} {stats['original_chars']:>7} -> {stats['compacted_chars']:>7} "
+              f"chars ({stats['compression_ratio']:.0%})")
+    if total_before:
+        print(f"\n📊 Total: {total_before} -> {total_after} chars ({total_after / total_before:.0%})")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] != "--report":
+        with open(sys.argv[1], "r", encoding="utf-8") as f:
+            compacted, stats = compact_transcript(f.read())
+        print(compacted)
+        print(f"\n📊 {stats}")
+    else:
+        report()
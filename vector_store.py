@@ -0,0 +1,642 @@
+import json
+import os
+import re
+import threading
+import time
+
+import profiling
+from env_flags import env_flag
+
+# --- CONFIGURATION ---
+DB_PATH = "./chroma_db"
+COLLECTION_NAME = "financial_knowledge"
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# --- EMBEDDING GENERATIONS ---
+# Which collection (and the model that embedded it) readers and writers use.
+# Until migrate_embeddings.py switches models this is COLLECTION_NAME +
+# EMBEDDING_MODEL_NAME. During a migration the state also names a "shadow"
+# generation that ingest dual-writes to. Readers re-check the file's mtime on
+# every query, so a switch reaches running apps without a restart.
+STATE_FILENAME = "embedding_state.json"
+
+# Which runtime computes the embeddings (same model, same vector space):
+#   "sentence-transformers" -> PyTorch (default)
+#   "onnx-int8"             -> quantized ONNX Runtime on CPU (see onnx_embeddings.py)
+# Override with the EMBEDDING_BACKEND environment variable / .env entry.
+EMBEDDING_BACKEND = "sentence-transformers"
+EMBEDDING_BACKENDS = ("sentence-transformers", "onnx-int8")
+
+# --- COLLECTION LAYOUT ---
+#   "shared"      -> one collection, every query filters on source_type (original)
+#   "partitioned" -> one collection per source type, institutional data further
+#                    split by INSTITUTIONAL_SUBPARTITION. Build it with
+#                    `python migrate_partitions.py migrate`.
+# Override with COLLECTION_LAYOUT / INSTITUTIONAL_SUBPARTITION env variables.
+COLLECTION_LAYOUT = "shared"
+COLLECTION_LAYOUTS = ("shared", "partitioned")
+INSTITUTIONAL_SUBPARTITION = "year"   # "year", "ticker" or "none"
+PARTITION_SEPARATOR = "__"
+SOURCE_TYPES = ("retail", "institutional")
+
+# HNSW settings applied when a partition is created. Every partition must use
+# the same space so distances can be merged across partitions.
+HNSW_SPACE = "l2"
+PARTITION_HNSW = {
+    # Large, fast-growing and noisy: bigger graph + wider search for recall
+    "retail": {"hnsw:M": 32, "hnsw:construction_ef": 200, "hnsw:search_ef": 100},
+    # Small per-year/per-ticker partitions: defaults are already near-exact
+    "institutional": {"hnsw:M": 16, "hnsw:construction_ef": 100, "hnsw:search_ef": 50},
+}
+PARTITION_CACHE_SECONDS = 60
+
+# --- RETRIEVAL BACKEND ---
+#   "chroma" -> HNSW search through Chroma (default)
+#   "numpy"  -> exact search over a memory-mapped matrix (see numpy_index.py,
+#               build it with `python numpy_index.py build`)
+# Override with the RETRIEVAL_BACKEND environment variable.
+RETRIEVAL_BACKEND = "chroma"
+RETRIEVAL_BACKENDS = ("chroma", "numpy")
+
+# Detect tickers / time ranges in the question and push them down as
+# metadata filters (see entity_extraction.py). Override with QUERY_PREFILTER=0.
+QUERY_PREFILTER = True
+
+# --- LAZY STATE ---
+# Nothing heavy happens at import time. chromadb and the embedding model are
+# only loaded the first time someone actually needs them, then cached.
+_lock = threading.RLock()
+_client = None
+_efs = {}
+_collections = {}
+_partition_cache = {"names": None, "time": 0.0}
+_state_cache = {"path": None, "mtime": None, "state": None}
+_warned = set()
+
+
+def get_client():
+    """
+    Returns the shared Chroma PersistentClient (created on first use).
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import chromadb
+                _client = chromadb.PersistentClient(path=DB_PATH)
+    return _client
+
+
+def get_embedding_backend():
+    # Read at call time so a .env loaded after import still counts
+    backend = os.environ.get("EMBEDDING_BACKEND", EMBEDDING_BACKEND).strip().lower()
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}'. Choose one of {EMBEDDING_BACKENDS}.")
+    return backend
+
+
+def create_embedding_function(backend=None, model_name=None):
+    """
+    Builds a fresh embedding function for the given backend and model (uncached).
+    The int8 ONNX export only exists for EMBEDDING_MODEL_NAME; other models
+    always run on sentence-transformers.
+    """
+    backend = backend or get_embedding_backend()
+    model_name = model_name or EMBEDDING_MODEL_NAME
+    if backend == "onnx-int8" and model_name == EMBEDDING_MODEL_NAME:
+        from onnx_embeddings import QuantizedOnnxEmbeddingFunction
+        return QuantizedOnnxEmbeddingFunction()
+
+    from chromadb.utils import embedding_functions
+    return embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name)
+
+
+def get_embedding_function(model_name=None):
+    """
+    Returns the shared embedding function for a model (loads it on first use).
+    Defaults to the model of the active generation.
+    """
+    model_name = model_name or active_generation()["model"]
+    ef = _efs.get(model_name)
+    if ef is None:
+        with _lock:
+            ef = _efs.get(model_name)
+            if ef is None:
+                ef = create_embedding_function(model_name=model_name)
+                _efs[model_name] = ef
+    return ef
+
+
+def embed(texts, model_name=None):
+    """
+    Embeds texts with a generation's model (the "embedding" profiling section).
+    """
+    with profiling.section("embedding"):
+        return get_embedding_function(model_name)(texts)
+
+
+# --- GENERATION STATE ---
+def state_path():
+    return os.path.join(DB_PATH, STATE_FILENAME)
+
+
+def read_state():
+    """
+    {"collection", "model"[, "shadow": {"collection", "model"}]}.
+    Re-read only when the file changes (one stat() per call).
+    """
+    path = state_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {"collection": COLLECTION_NAME, "model": EMBEDDING_MODEL_NAME}
+
+    if _state_cache["path"] != path or _state_cache["mtime"] != mtime:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        _state_cache.update(path=path, mtime=mtime, state=state)
+    return _state_cache["state"]
+
+
+def write_state(state):
+    """
+    Atomic replace: readers see either the old or the new file, never half of one.
+    """
+    path = state_path()
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _partition_cache["names"] = None
+
+
+def active_generation():
+    state = read_state()
+    return {"collection": state["collection"], "model": state["model"]}
+
+
+def shadow_generation():
+    return read_state().get("shadow")
+
+
+def write_generations():
+    """
+    Where ingest writes: the active generation, plus the shadow one while a
+    migration is running.
+    """
+    generations = [active_generation()]
+    shadow = shadow_generation()
+    if shadow:
+        generations.append(shadow)
+    return generations
+
+
+def rebase(name, base):
+    """
+    The same collection in another generation:
+    financial_knowledge__retail -> <base>__retail
+    """
+    _, sep, rest = name.partition(PARTITION_SEPARATOR)
+    return base + sep + rest
+
+
+def _model_for(name):
+    base = name.split(PARTITION_SEPARATOR)[0]
+    state = read_state()
+    for generation in (state, state.get("shadow") or {}):
+        if generation.get("collection") == base:
+            return generation["model"]
+    return EMBEDDING_MODEL_NAME
+
+
+def get_collection(name=None, create=True, metadata=None):
+    """
+    Returns a cached collection handle (default: the active generation's
+    shared collection). The embedding function is the one of the model that
+    embedded the collection's generation.
+    create=True  -> get_or_create (writers, e.g. ingest)
+    create=False -> get only, raises if the collection is missing (readers)
+    metadata is only used when the collection is created (e.g. HNSW settings).
+    """
+    name = name or active_generation()["collection"]
+    collection = _collections.get(name)
+    if collection is None:
+        with _lock:
+            collection = _collections.get(name)
+            if collection is None:
+                client = get_client()
+                ef = get_embedding_function(_model_for(name))
+                if create:
+                    collection = client.get_or_create_collection(name=name, embedding_function=ef, metadata=metadata)
+                else:
+                    collection = client.get_collection(name=name, embedding_function=ef)
+                _collections[name] = collection
+    return collection
+
+
+# --- PARTITIONING ---
+def get_collection_layout():
+    layout = os.environ.get("COLLECTION_LAYOUT", COLLECTION_LAYOUT).strip().lower()
+    if layout not in COLLECTION_LAYOUTS:
+        raise ValueError(f"Unknown COLLECTION_LAYOUT '{layout}'. Choose one of {COLLECTION_LAYOUTS}.")
+    return layout
+
+
+def _slug(text, max_len=24):
+    # Chroma names: [a-zA-Z0-9._-], must start and end with an alphanumeric
+    clean = re.sub(r"[^a-z0-9]+", "-", str(text).lower()).strip("-")
+    return clean[:max_len].strip("-") or "unknown"
+
+
+def _subpartition_key(metadata):
+    """
+    Institutional sub-partition for one unit, derived from its source filename
+    (e.g. institutional_Sunway_20260102_HLIB_processed.json).
+    """
+    mode = os.environ.get("INSTITUTIONAL_SUBPARTITION", INSTITUTIONAL_SUBPARTITION).strip().lower()
+    if mode == "none":
+        return None
+
+    stem = metadata.get("filename", "").replace("institutional_", "", 1)
+    match = re.search(r"_(\d{4})(\d{2})(\d{2})_", stem)
+    if mode == "year":
+        return match.group(1) if match else "undated"
+
+    # mode == "ticker": the company part of the filename
+    company = stem[:match.start()] if match else os.path.splitext(stem)[0]
+    return _slug(company)
+
+
+def partition_name(metadata, base=None):
+    """
+    Name of the partition collection a unit belongs to.
+    """
+    source_type = metadata.get("source_type", "unknown")
+    parts = [base or active_generation()["collection"], source_type]
+    if source_type == "institutional":
+        key = _subpartition_key(metadata)
+        if key:
+            parts.append(key)
+    return PARTITION_SEPARATOR.join(parts)
+
+
+def partition_settings(source_type):
+    settings = {"hnsw:space": HNSW_SPACE}
+    settings.update(PARTITION_HNSW.get(source_type, {}))
+    return settings
+
+
+def list_partitions(source_type, refresh=False, base=None):
+    """
+    Existing partition collections for a source type (cached for a minute so
+    the router doesn't list collections on every query).
+    """
+    now = time.time()
+    names = _partition_cache["names"]
+    if refresh or names is None or now - _partition_cache["time"] > PARTITION_CACHE_SECONDS:
+        # Older Chroma returns Collection objects, newer returns plain names
+        names = [getattr(c, "name", c) for c in get_client().list_collections()]
+        _partition_cache["names"] = names
+        _partition_cache["time"] = now
+
+    prefix = f"{base or active_generation()['collection']}{PARTITION_SEPARATOR}{source_type}"
+    return sorted(n for n in names if n == prefix or n.startswith(prefix + PARTITION_SEPARATOR))
+
+
+def _merge_where(source_type, where):
+    base = {"source_type": source_type}
+    if not where:
+        return base
+    return {"$and": [base, where]}
+
+
+def collection_for(metadata, base=None):
+    """
+    Name of the collection a unit is (or will be) stored in under the active layout.
+    """
+    if get_collection_layout() == "shared":
+        return base or active_generation()["collection"]
+    return partition_name(metadata, base)
+
+
+def layout_collections(base=None):
+    """
+    Every existing collection of one generation under the active layout.
+    """
+    base = base or active_generation()["collection"]
+    if get_collection_layout() == "shared":
+        return [base]
+    return [n for st in SOURCE_TYPES for n in list_partitions(st, refresh=True, base=base)]
+
+
+def add_units(documents, metadatas, ids):
+    """
+    Writes units to whichever layout is active, in every write generation
+    (each collection embeds the documents with its own model).
+    Partitioned layout groups the batch by partition and upserts each group.
+    """
+    for generation in write_generations():
+        _add_units_to(generation["collection"], documents, metadatas, ids)
+
+
+def _add_units_to(base, documents, metadatas, ids):
+    # Embed explicitly (once) so the NumPy index gets the same vectors as Chroma
+    embeddings = embed(documents, _model_for(base))
+
+    if get_collection_layout() == "shared":
+        with profiling.section("chroma.upsert"):
+            get_collection(base).upsert(documents=documents, embeddings=embeddings, metadatas=metadatas, ids=ids)
+    else:
+        groups = {}
+        for doc, emb, meta, uid in zip(documents, embeddings, metadatas, ids):
+            group = groups.setdefault(partition_name(meta, base), ([], [], [], []))
+            group[0].append(doc)
+            group[1].append(emb)
+            group[2].append(meta)
+            group[3].append(uid)
+
+        for name, (docs, embs, metas, uids) in groups.items():
+            collection = get_collection(name, metadata=partition_settings(metas[0]["source_type"]))
+            with profiling.section("chroma.upsert"):
+                collection.upsert(documents=docs, embeddings=embs, metadatas=metas, ids=uids)
+        _partition_cache["names"] = None  # A new partition may have been created
+
+    import numpy_index
+    if numpy_index.index_exists(base):
+        numpy_index.append(base, ids, embeddings, documents, metadatas)
+
+
+def update_metadata(collection_name, patches):
+    """
+    Merges {id: {key: value}} patches into the stored metadata of one
+    collection, in every write generation. collection_name may come from an
+    older generation (e.g. the near-dedup index); it is rebased first.
+    """
+    if not patches:
+        return
+    active, *shadows = write_generations()
+    _update_metadata_in(rebase(collection_name, active["collection"]), patches)
+    for shadow in shadows:
+        try:
+            _update_metadata_in(rebase(collection_name, shadow["collection"]), patches)
+        except Exception:
+            # Not copied yet: the migration will pick up the patched metadata
+            pass
+
+
+def _update_metadata_in(collection_name, patches):
+    collection = get_collection(collection_name, create=False)
+    ids = list(patches)
+    current = collection.get(ids=ids, include=["metadatas"])
+    merged_ids, merged = [], []
+    for uid, meta in zip(current["ids"], current["metadatas"]):
+        merged_ids.append(uid)
+        merged.append({**(meta or {}), **patches[uid]})
+    if merged_ids:
+        collection.update(ids=merged_ids, metadatas=merged)
+
+    import numpy_index
+    base = collection_name.split(PARTITION_SEPARATOR)[0]
+    if merged_ids and numpy_index.index_exists(base):
+        numpy_index.patch(base, {uid: patches[uid] for uid in merged_ids})
+
+
+def delete_units(collection_name, ids):
+    """
+    Deletes units from one collection (and the NumPy index), in every write generation.
+    """
+    import numpy_index
+    for generation in write_generations():
+        name = rebase(collection_name, generation["collection"])
+        try:
+            get_collection(name, create=False).delete(ids=ids)
+        except Exception:
+            if generation["collection"] == active_generation()["collection"]:
+                raise
+            continue
+        if numpy_index.index_exists(generation["collection"]):
+            numpy_index.delete(generation["collection"], ids)
+
+
+def get_retrieval_backend():
+    backend = os.environ.get("RETRIEVAL_BACKEND", RETRIEVAL_BACKEND).strip().lower()
+    if backend not in RETRIEVAL_BACKENDS:
+        raise ValueError(f"Unknown RETRIEVAL_BACKEND '{backend}'. Choose one of {RETRIEVAL_BACKENDS}.")
+    return backend
+
+
+def _numpy_query(source_type, n_results, query_texts, query_embeddings, where, generation):
+    """
+    The NumPy backend, or None if its index hasn't been built (-> Chroma).
+    """
+    import numpy_index
+
+    base = generation["collection"]
+    if not numpy_index.index_exists(base):
+        if base not in _warned:
+            _warned.add(base)
+            print(f"⚠️ RETRIEVAL_BACKEND=numpy but no index for '{base}' "
+                  f"(python numpy_index.py build). Using Chroma.")
+        return None
+    if query_embeddings is None:
+        query_embeddings = embed(query_texts, generation["model"])
+    with profiling.section("numpy.query"):
+        return numpy_index.get_index(base).query(source_type, query_embeddings, n_results, where=where)
+
+
+def query_source(source_type, n_results, query_texts=None, query_embeddings=None, where=None,
+                 generation=None):
+    """
+    The retrieval router. Returns a Chroma-style result dict
+    ({"ids", "documents", "metadatas", "distances"}, one list per query).
+
+    numpy       -> exact search in the NumPy index (RETRIEVAL_BACKEND=numpy)
+    shared      -> one filtered query on the shared collection
+    partitioned -> query every partition of the source type and merge by distance
+
+    Pass the `generation` the query_embeddings were computed with, so a model
+    switch between embedding and querying can't mix vector spaces.
+    """
+    generation = generation or active_generation()
+    base = generation["collection"]
+    if get_retrieval_backend() == "numpy":
+        results = _numpy_query(source_type, n_results, query_texts, query_embeddings, where, generation)
+        if results is not None:
+            return results
+
+    if get_collection_layout() == "shared":
+        if query_embeddings is None:
+            query_embeddings = embed(query_texts, generation["model"])
+        collection = get_collection(base, create=False)
+        with profiling.section("chroma.query"):
+            return collection.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=_merge_where(source_type, where),
+            )
+
+    if query_embeddings is None:
+        # Embed once, not once per partition
+        query_embeddings = embed(query_texts, generation["model"])
+    n_queries = len(query_embeddings)
+
+    merged = [[] for _ in range(n_queries)]
+    for name in list_partitions(source_type, base=base):
+        collection = get_collection(name, create=False)
+        with profiling.section("chroma.query"):
+            results = collection.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where or None,
+            )
+        for q in range(n_queries):
+            merged[q].extend(zip(
+                results["distances"][q],
+                results["ids"][q],
+                results["documents"][q],
+                results["metadatas"][q],
+            ))
+
+    out = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+    for rows in merged:
+        rows.sort(key=lambda r: r[0])
+        rows = rows[:n_results]
+        out["distances"].append([r[0] for r in rows])
+        out["ids"].append([r[1] for r in rows])
+        out["documents"].append([r[2] for r in rows])
+        out["metadatas"].append([r[3] for r in rows])
+    return out
+
+
+def prefilter_enabled():
+    return env_flag("QUERY_PREFILTER", QUERY_PREFILTER)
+
+
+def _filter_attempts(query, prefilter=None):
+    """
+    The where clauses to try for one question, tightest first:
+    tickers + dates -> tickers only -> no filter.
+    """
+    from entity_extraction import build_where, parse_query_filters
+
+    if prefilter is None:
+        prefilter = prefilter_enabled()
+    if not prefilter:
+        return [None]
+
+    filters = parse_query_filters(query)
+    attempts = [
+        build_where(filters),
+        build_where(filters, use_dates=False),
+        None,
+    ]
+    # Drop repeats (e.g. no date range found) but keep the order
+    return [w for i, w in enumerate(attempts) if w not in attempts[:i]]
+
+
+def search(source_type, query, n_results, query_embedding=None, prefilter=None, generation=None):
+    """
+    One question against one source type, with entity/date pre-filtering.
+    Tries the tightest filter first and relaxes it (drop the date range, then
+    the tickers) only when nothing matches, e.g. for undated retail units.
+    Returns the same Chroma-style dict as query_source().
+    """
+    attempts = _filter_attempts(query, prefilter)
+    generation = generation or active_generation()
+
+    if query_embedding is None and len(attempts) > 1:
+        # Embed once instead of once per attempt
+        query_embedding = embed([query], generation["model"])[0]
+
+    for where in attempts:
+        if query_embedding is None:
+            results = query_source(source_type, n_results, query_texts=[query], where=where,
+                                   generation=generation)
+        else:
+            results = query_source(source_type, n_results, query_embeddings=[query_embedding], where=where,
+                                   generation=generation)
+        if results["documents"] and results["documents"][0]:
+            return results
+    return results
+
+
+def search_batch(source_type, queries, n_results, query_embeddings=None, prefilter=None, generation=None):
+    """
+    Batched search(): questions that end up with the same where clause are
+    sent to Chroma together in one query_embeddings call. Returns one
+    single-question result dict per input question, in order.
+    """
+    queries = list(queries)
+    generation = generation or active_generation()
+    if query_embeddings is None:
+        query_embeddings = embed(queries, generation["model"])
+
+    attempts = [_filter_attempts(q, prefilter) for q in queries]
+    results = [None] * len(queries)
+    pending = list(range(len(queries)))
+    level = 0
+
+    while pending:
+        # Group the still-unanswered questions by their filter at this level
+        groups = {}
+        for i in pending:
+            where = attempts[i][min(level, len(attempts[i]) - 1)]
+            key = json.dumps(where, sort_keys=True)
+            groups.setdefault(key, (where, []))[1].append(i)
+
+        retry = []
+        for where, indices in groups.values():
+            batch = query_source(
+                source_type, n_results,
+                query_embeddings=[query_embeddings[i] for i in indices],
+                where=where,
+                generation=generation,
+            )
+            for row, i in enumerate(indices):
+                results[i] = {
+                    key: [batch[key][row]]
+                    for key in ("ids", "documents", "metadatas", "distances")
+                    if batch.get(key) is not None
+                }
+                if not batch["documents"][row] and level < len(attempts[i]) - 1:
+                    retry.append(i)
+
+        pending = retry
+        level += 1
+
+    return results
+
+
+def warm_up(background=True, create=True):
+    """
+    Pre-loads the client, the embedding model and the collection.
+    With background=True this runs in a daemon thread so the caller can keep
+    starting up; the first real request then finds everything ready.
+    """
+    def _run():
+        try:
+            if get_collection_layout() == "shared":
+                get_collection(create=create)
+            else:
+                for name in layout_collections():
+                    get_collection(name, create=False)
+            if get_retrieval_backend() == "numpy":
+                import numpy_index
+                base = active_generation()["collection"]
+                if numpy_index.index_exists(base):
+                    numpy_index.get_index(base).refresh()
+            # The first encode call is noticeably slower than the rest.
+            get_embedding_function()(["warm up"])
+            print("🔥 Vector store warmed up.")
+        except Exception as e:
+            print(f"⚠️ Warm-up failed: {e}")
+
+    if not background:
+        _run()
+        return None
+
+    thread = threading.Thread(target=_run, name="vector-store-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,312 @@
+"""
+Lease-based work claiming so several pipeline workers can share one data/ volume.
+
+Before a worker sends a file to the LLM (batch_processor) or ingests a
+processed JSON (ingest_vectors), it claims the file in a shared SQLite table:
+  - a claim is a lease: it expires LEASE_SECONDS after the last heartbeat
+  - a background thread heartbeats every lease the process holds, so long
+    LLM retries don't lose their claim
+  - a lease that stopped heartbeating (crashed / killed worker) can be
+    taken over by anyone; pipeline_watcher re-dispatches them periodically
+  - `remember=True` claims leave a "done" row behind so the same version of
+    the file (mtime + size) is never picked up twice (ingest has no output
+    file to check, unlike batch_processor)
+
+Every finished lease is written to a history table, which is where the
+per-worker throughput report comes from.
+
+The database must live on a filesystem with working POSIX locks (local disk,
+or NFS/SMB with locking enabled), and hosts should keep their clocks synced:
+leases are compared against wall-clock time.
+
+Keys are namespaced strings: "process:<category>/<file>", "ingest:<source>/<file>".
+Workers are identified by WORKER_ID (default "<hostname>:<pid>").
+
+Usage:
+    python work_claims.py status            # active and expired leases
+    python work_claims.py report [--hours N] # per-worker throughput
+    python work_claims.py forget KEY        # drop a claim/done marker so KEY runs again
+"""
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# --- CONFIGURATION ---
+CLAIMS_PATH = "data/work_claims.sqlite"
+LEASE_SECONDS = 10 * 60       # A claim survives this long without a heartbeat
+HEARTBEAT_SECONDS = 60
+CLAIMED = "claimed"
+DONE = "done"
+
+
+def worker_id():
+    return os.environ.get("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+
+def file_version(path):
+    """
+    Identifies one version of a file, so a rewritten file can be claimed again.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ""
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+class Lease:
+    """
+    Returned by WorkClaims.lease(). Falsy if the claim was refused.
+    Set `outcome` to anything but "done" to record a failure (the claim is
+    then released so another worker can retry).
+    """
+
+    def __init__(self, key, claimed):
+        self.key = key
+        self.claimed = claimed
+        self.outcome = "done"
+
+    def __bool__(self):
+        return self.claimed
+
+
+class WorkClaims:
+    def __init__(self, path=CLAIMS_PATH, worker=None):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.worker = worker or worker_id()
+        # Autocommit mode: claims use explicit BEGIN IMMEDIATE transactions
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._held = {}   # key -> claimed_at
+        self._heartbeat = None
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS claims (
+                    key TEXT PRIMARY KEY,
+                    path TEXT,
+                    version TEXT,
+                    worker TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    claimed_at REAL NOT NULL,
+                    lease_until REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS history (
+                    key TEXT NOT NULL,
+                    worker TEXT NOT NULL,
+                    outcome TEXT NOT NULL,
+                    started REAL NOT NULL,
+                    finished REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_history_finished ON history(finished);
+            """)
+
+    # --- CLAIMING ---
+    def claim(self, key, path="", version=""):
+        """
+        Atomically claims key for this worker. Succeeds if nobody holds it,
+        the previous lease expired, or only a "done" marker for an older
+        version exists. A live lease is refused even when this worker holds
+        it (a second holder's release would end the first one's lease).
+        Returns True/False.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT worker, status, version, lease_until FROM claims WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    worker, status, old_version, lease_until = row
+                    if status == DONE and old_version == version:
+                        self._conn.execute("ROLLBACK")
+                        return False
+                    if status == CLAIMED and lease_until > now:
+                        self._conn.execute("ROLLBACK")
+                        return False
+                    if status == CLAIMED and worker != self.worker:
+                        print(f"♻️ Reclaiming expired lease on {key} from {worker}")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO claims (key, path, version, worker, status, claimed_at, lease_until) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, path, version, self.worker, CLAIMED, now, now + LEASE_SECONDS),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._held[key] = now
+        self._ensure_heartbeat()
+        return True
+
+    def release(self, key, outcome="done", remember=False):
+        """
+        Ends this worker's lease. With remember=True a successful claim turns
+        into a "done" marker; otherwise the row is removed.
+        """
+        now = time.time()
+        with self._lock:
+            started = self._held.pop(key, now)
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if remember and outcome == "done":
+                    self._conn.execute(
+                        "UPDATE claims SET status = ?, lease_until = ? WHERE key = ? AND worker = ?",
+                        (DONE, now, key, self.worker),
+                    )
+                else:
+                    self._conn.execute("DELETE FROM claims WHERE key = ? AND worker = ?", (key, self.worker))
+                self._conn.execute(
+                    "INSERT INTO history (key, worker, outcome, started, finished) VALUES (?, ?, ?, ?, ?)",
+                    (key, self.worker, outcome, started, now),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @contextmanager
+    def lease(self, key, path="", version="", remember=False):
+        """
+        with claims.lease(key) as lease:
+            if not lease: return      # someone else has it
+            ...                       # an exception records a failure
+        """
+        lease = Lease(key, self.claim(key, path, version))
+        if not lease:
+            yield lease
+            return
+        try:
+            yield lease
+        except BaseException:
+            lease.outcome = "failed"
+            raise
+        finally:
+            self.release(key, lease.outcome, remember=remember)
+
+    # --- HEARTBEAT ---
+    def heartbeat(self):
+        """
+        Extends every lease this process holds. Warns about leases that were
+        taken over (e.g. after this host was suspended longer than a lease).
+        """
+        now = time.time()
+        with self._lock:
+            for key in list(self._held):
+                cursor = self._conn.execute(
+                    "UPDATE claims SET lease_until = ? WHERE key = ? AND worker = ? AND status = ?",
+                    (now + LEASE_SECONDS, key, self.worker, CLAIMED),
+                )
+                if cursor.rowcount == 0:
+                    print(f"⚠️ Lost lease on {key} (another worker reclaimed it)")
+
+    def _ensure_heartbeat(self):
+        if self._heartbeat is not None:
+            return
+        with self._lock:
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="work-claims-heartbeat",
+                                                   daemon=True)
+                self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"⚠️ Heartbeat failed: {e}")
+
+    # --- INSPECTION ---
+    def expired(self):
+        """
+        (key, path, worker) for leases whose worker stopped heartbeating.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, path, worker FROM claims WHERE status = ? AND lease_until < ? ORDER BY claimed_at",
+                (CLAIMED, time.time()),
+            ).fetchall()
+
+    def active(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, worker, claimed_at, lease_until FROM claims WHERE status = ? ORDER BY claimed_at",
+                (CLAIMED,),
+            ).fetchall()
+
+    def throughput(self, since=0.0):
+        """
+        Per-worker rows: (worker, done, failed, busy_seconds, first_start, last_finish).
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT worker, SUM(outcome = 'done'), SUM(outcome != 'done'), SUM(finished - started), "
+                "MIN(started), MAX(finished) FROM history WHERE finished >= ? GROUP BY worker ORDER BY worker",
+                (since,),
+            ).fetchall()
+
+    def drop_expired(self, key):
+        """
+        Removes key's claim if it is still expired, i.e. nobody picked it up
+        again (the file was skipped or is gone). Returns True if removed.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM claims WHERE key = ? AND status = ? AND lease_until < ?",
+                (key, CLAIMED, time.time()),
+            )
+            return cursor.rowcount > 0
+
+    def forget(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM claims WHERE key = ?", (key,))
+
+
+_claims = None
+_claims_lock = threading.Lock()
+
+def get_claims():
+    global _claims
+    if _claims is None:
+        with _claims_lock:
+            if _claims is None:
+                _claims = WorkClaims()
+    return _claims
+
+
+def print_status():
+    claims = get_claims()
+    now = time.time()
+    rows = claims.active()
+    print(f"🔒 Active claims: {len(rows)}")
+    for key, worker, claimed_at, lease_until in rows:
+        state = f"expires in {lease_until - now:.0f}s" if lease_until > now else "EXPIRED"
+        print(f"   {key}  ({worker}, held {now - claimed_at:.0f}s, {state})")
+
+
+def print_report(hours=24):
+    rows = get_claims().throughput(since=time.time() - hours * 3600)
+    print(f"📊 Per-worker throughput (last {hours}h): {len(rows)} workers")
+    for worker, done, failed, busy, first, last in rows:
+        span = max(last - first, 1e-9)
+        print(f"   {worker:<32} done {done:>5}  failed {failed:>4}  "
+              f"{done / span * 3600:>7.1f} files/h  avg {busy / max(done + failed, 1):>6.1f}s/file")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "status":
+        print_status()
+    elif command == "report":
+        hours = float(sys.argv[sys.argv.index("--hours") + 1]) if "--hours" in sys.argv else 24
+        print_report(hours)
+    elif command == "forget" and len(sys.argv) > 2:
+        get_claims().forget(sys.argv[2])
+        print(f"🔁 {sys.argv[2]} can be claimed again.")
+    else:
+        print(__doc__)